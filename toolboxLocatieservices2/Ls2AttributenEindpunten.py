@@ -1,154 +1,988 @@
+import csv
+import gzip
+import hashlib
 import importlib
+import inspect
 import json
+import math
 import os
+import random
+import sqlite3
 import sys
-import urllib
+import threading
+import time
+import urllib.error
+import urllib.request
+from array import array
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 from qgis.core import (
+    QgsCurve,
+    QgsDataSourceUri,
+    QgsFeature,
     QgsFeatureRequest,
+    QgsFeatureSink,
     QgsField,
+    QgsFields,
+    QgsGeometry,
+    QgsGeometryCollection,
+    QgsPoint,
+    QgsPointXY,
     QgsWkbTypes,
     QgsProcessingUtils,
     QgsProcessingFeatureSourceDefinition,
     QgsProject,
-    QgsProperty
+    QgsProperty,
+    QgsProviderRegistry,
+    QgsUnitTypes,
+    QgsVectorLayer
 )
 from qgis.PyQt.QtCore import QVariant
 
 OMGEVING = "apps"  # productie
 
+MODULES_JSON_URL = "https://raw.githubusercontent.com/joachimdero/toolboxScriptsQgis/refs/heads/master/toolboxLocatieservices2/modulesFromGithub.json"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".qgis_module_cache")
+MANIFEST_PAD = os.path.join(CACHE_DIR, "manifest.json")
+MODULE_CACHE_TTL = 3600  # seconden dat een gecachte module niet opnieuw gecontroleerd wordt
+RESULTAAT_CACHE_PAD = os.path.join(CACHE_DIR, "ls2_resultaten.sqlite")
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, "checkpoints")
+RETRY_WACHTTIJD = 1.0  # seconden, basis voor exponentiële backoff
+# zoveel afzonderlijk mislukte deelrequests zonder één succes in de chunk: LS2 ligt plat, chunk afbreken
+STORING_NA_FOUTEN = 3
+OPNAME_MODI = ["uit", "opnemen", "afspelen"]  # volgorde = opties van 'opname modus' in de tool
+WEGTYPES = [None, "Genummerd"]  # volgorde = opties van 'wegtype' in de tool (None = geen filter)
+KANT_VAN_DE_WEG = ["true", "false"]  # volgorde = opties van 'gebruik kant van de weg' in de tool
+SESSIE_IDLE_TIMEOUT = 900  # seconden dat een ongebruikte sessie in het sessieregister blijft
+
+# Compacte weergave van een feature binnen een chunk: wordt één keer gelezen in
+# maak_json_locatie en hergebruikt bij het wegschrijven (geen tweede getFeatures).
+# feature wordt enkel bijgehouden in sink-modus (kopie naar de uitvoerlaag).
+FeatureRecord = namedtuple("FeatureRecord", ["fid", "punten", "wegnummer", "feature"], defaults=(None,))
+
+# Index van een locatie: (fid, deel, eindpunt); de writer koppelt responses via deze index
+# en niet via hun positie, zodat multipart/lege features de buren niet kunnen verschuiven.
+BEGIN = "begin"
+EIND = "eind"
+PUNT = "punt"
+EINDPUNTEN = (BEGIN, EIND, PUNT)  # code in CompacteLocaties.eindpunt -> eindpunt
+
+
+class CompacteLocaties:
+    """
+    De locaties van een chunk als kolommen (array) i.p.v. een geneste dict per punt:
+    fid, deel, eindpunt (code in EINDPUNTEN), x, y en wegnummer_id (index in wegnummers, -1 = geen).
+    Pas aan de transportgrens (request_ls2_puntlocatie) worden de dicts opgebouwd met als_json.
+    """
+
+    __slots__ = ("crs_id", "fid", "deel", "eindpunt", "x", "y", "wegnummer_id", "wegnummers", "_wegnummer_ids")
+
+    def __init__(self, crs_id, wegnummers=None, wegnummer_ids=None):
+        self.crs_id = crs_id
+        self.fid = array("q")
+        self.deel = array("i")
+        self.eindpunt = array("b")
+        self.x = array("d")
+        self.y = array("d")
+        self.wegnummer_id = array("i")
+        # wegnummers worden één keer bewaard en gedeeld met selecties van deze locaties
+        self.wegnummers = [] if wegnummers is None else wegnummers
+        self._wegnummer_ids = {} if wegnummer_ids is None else wegnummer_ids
+
+    def voeg_toe(self, fid, deel, eindpunt, x, y, wegnummer=None):
+        if wegnummer is None:
+            wegnummer_id = -1
+        else:
+            wegnummer_id = self._wegnummer_ids.get(wegnummer)
+            if wegnummer_id is None:
+                wegnummer_id = self._wegnummer_ids[wegnummer] = len(self.wegnummers)
+                self.wegnummers.append(wegnummer)
+        self.fid.append(fid)
+        self.deel.append(deel)
+        self.eindpunt.append(EINDPUNTEN.index(eindpunt))
+        self.x.append(x)
+        self.y.append(y)
+        self.wegnummer_id.append(wegnummer_id)
+
+    def __len__(self):
+        return len(self.fid)
+
+    def coordinaten(self, i):
+        return self.x[i], self.y[i]
+
+    def wegnummer(self, i):
+        wegnummer_id = self.wegnummer_id[i]
+        return None if wegnummer_id < 0 else self.wegnummers[wegnummer_id]
+
+    def indices(self):
+        """(fid, deel, eindpunt) per locatie, zoals schrijf_resultaten_naar_layer ze verwacht."""
+        return zip(self.fid, self.deel, (EINDPUNTEN[code] for code in self.eindpunt))
+
+    def selectie(self, posities):
+        """Nieuwe CompacteLocaties met enkel de locaties op posities (zelfde wegnummertabel)."""
+        deel = CompacteLocaties(self.crs_id, self.wegnummers, self._wegnummer_ids)
+        for kolom in ("fid", "deel", "eindpunt", "x", "y", "wegnummer_id"):
+            bron = getattr(self, kolom)
+            getattr(deel, kolom).extend(bron[i] for i in posities)
+        return deel
+
+    def locatie(self, i):
+        locatie = {
+            "geometry": {
+                "crs": maak_crs_blok(self.crs_id),
+                "type": "Point",
+                "coordinates": [self.x[i], self.y[i]]
+            }
+        }
+        wegnummer = self.wegnummer(i)
+        if wegnummer is not None:
+            # gekend wegnummer meesturen: LS2 zoekt dan enkel op die weg
+            locatie["wegnummer"] = {"nummer": wegnummer}
+        return locatie
+
+    def als_json(self, posities=None):
+        """De LS2-locaties (lijst van dicts) voor posities, standaard alle locaties."""
+        return [self.locatie(i) for i in (range(len(self)) if posities is None else posities)]
+
+
+NIET_GEZET = object()  # markering in CompacteWijzigingen: veld niet wijzigen (None is een geldige waarde)
+
+
+class CompacteWijzigingen:
+    """
+    Resultaatwaarden als één tuple per feature in vaste kolommen (veld-indices) i.p.v. een dict per feature.
+    De {fid: {veld_idx: waarde}}-map voor de provider wordt pas bij het wegschrijven opgebouwd (als_dict).
+    Itereren geeft de fids, zodat set(wijzigingen) werkt zoals bij een dict.
+    """
+
+    __slots__ = ("kolommen", "fids", "rijen")
+
+    def __init__(self, kolommen):
+        self.kolommen = tuple(kolommen)
+        self.fids = array("q")
+        self.rijen = []
+
+    def voeg_toe(self, fid, waarden):
+        self.fids.append(fid)
+        self.rijen.append(tuple(waarden))
+
+    def __len__(self):
+        return len(self.fids)
+
+    def __iter__(self):
+        return iter(self.fids)
+
+    def als_dict(self, doel=None):
+        """Voeg de wijzigingen toe aan doel ({fid: {veld_idx: waarde}}) en geef doel terug."""
+        doel = {} if doel is None else doel
+        for fid, rij in zip(self.fids, self.rijen):
+            attrs = {idx: waarde for idx, waarde in zip(self.kolommen, rij) if waarde is not NIET_GEZET}
+            if attrs:
+                doel.setdefault(fid, {}).update(attrs)
+        return doel
+
+
+def als_wijzigingen_dict(changes, doel=None):
+    """{fid: {veld_idx: waarde}} uit een dict of CompacteWijzigingen (samengevoegd in doel indien opgegeven)."""
+    if isinstance(changes, CompacteWijzigingen):
+        return changes.als_dict(doel)
+    if doel is None:
+        return changes
+    for fid, attrs in changes.items():
+        doel.setdefault(fid, {}).update(attrs)
+    return doel
+
+
+class Chunk:
+    """Toestand van één chunk tussen voorbereiden (hoofdthread), LS2-request (pool) en wegschrijven (hoofdthread)."""
+
+    def __init__(self, records, locaties, unieke_locaties, verwijzingen):
+        self.records = records
+        self.fids = []  # alle fids van de chunk (ook zonder bruikbare geometrie)
+        self.verwerkt = 0  # aantal fids uit de FidStroom tot en met deze chunk, voor het checkpoint
+        self.locaties = locaties  # CompacteLocaties
+        self.unieke_locaties = unieke_locaties  # CompacteLocaties (na ontdubbeling)
+        self.verwijzingen = verwijzingen  # locaties[i] -> unieke_locaties[verwijzingen[i]]
+        self.uit_cache = {}  # index in unieke_locaties -> response uit de resultaat cache
+        self.lokaal = {}  # index in unieke_locaties -> response van de lokale referentie-engine
+        self.te_vragen = array("i", range(len(unieke_locaties)))  # indices die naar LS2 moeten
+        self.future = None  # levert (responses, seconden, gesplitst, bytes verzonden, bytes ontvangen)
+        self.rij = {}  # metingen van deze chunk in RunStatistieken
+
+
+try:
+    from qgis.core import Qgis
+    NO_GEOMETRY = Qgis.FeatureRequestFlag.NoGeometry
+except (ImportError, AttributeError):
+    NO_GEOMETRY = QgsFeatureRequest.NoGeometry
+
+try:
+    from qgis.core import Qgis
+    PUNT_GEOMETRIE, LIJN_GEOMETRIE = Qgis.GeometryType.Point, Qgis.GeometryType.Line
+except (ImportError, AttributeError):
+    PUNT_GEOMETRIE, LIJN_GEOMETRIE = QgsWkbTypes.PointGeometry, QgsWkbTypes.LineGeometry
+
+# QGIS 4 / Qt6 gebruikt QMetaType i.p.v. int(QVariant.*)
+try:
+    from qgis.PyQt.QtCore import QMetaType
+
+    TYPE_STRING = QMetaType.Type.QString
+    TYPE_DOUBLE = QMetaType.Type.Double
+    TYPE_INT = QMetaType.Type.Int
+    TYPE_LONGLONG = QMetaType.Type.LongLong
+    VELDTYPES = "QMetaType (QGIS/Qt6)"
+except Exception:
+    # Fallback voor QGIS 3 / Qt5
+    TYPE_STRING = QVariant.String
+    TYPE_DOUBLE = QVariant.Double
+    TYPE_INT = QVariant.Int
+    TYPE_LONGLONG = QVariant.LongLong
+    VELDTYPES = "QVariant (QGIS/Qt5)"
+
+
+try:
+    METER = Qgis.DistanceUnit.Meters
+except (NameError, AttributeError):
+    METER = QgsUnitTypes.DistanceMeters
+
+
+def tolerantie_in_kaarteenheden(tolerantie_m, crs):
+    """
+    Zet een snaptolerantie in meter om naar de kaarteenheden van crs.
+    Voor graden is dat de omrekening op de evenaar: in lengtegraad is de tolerantie op onze
+    breedtegraad dus kleiner dan gevraagd (nooit groter), zodat geen verschillende punten samenvallen.
+    """
+    if tolerantie_m <= 0:
+        return 0.0
+    return tolerantie_m * QgsUnitTypes.fromUnitToUnitFactor(METER, crs.mapUnits())
+
+
+def is_lijn(geom_type):
+    """
+    True voor lijnlagen, ook CompoundCurve, CircularString en MultiCurve.
+    geom_type: wkbType (bv. layer.wkbType()) of de displayString ervan.
+    """
+    if isinstance(geom_type, str):
+        geom_type = QgsWkbTypes.parseType(geom_type)
+    return QgsWkbTypes.geometryType(geom_type) == LIJN_GEOMETRIE
+
+
+def _lees_manifest():
+    """Lees het cache-manifest ({naam: {url, etag, last_modified, sha256, gecontroleerd}})."""
+    try:
+        with open(MANIFEST_PAD, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _schrijf_manifest(manifest):
+    # Eerst naar tijdelijk bestand, dan atomair vervangen (parallelle runs)
+    tmp_pad = f"{MANIFEST_PAD}.{os.getpid()}.tmp"
+    with open(tmp_pad, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_pad, MANIFEST_PAD)
+
+
+def _sha256_bestand(pad):
+    h = hashlib.sha256()
+    with open(pad, "rb") as f:
+        for blok in iter(lambda: f.read(65536), b""):
+            h.update(blok)
+    return h.hexdigest()
+
 
-def load_module_from_github(feedback=None):
-    def load_json_modules():
-        raw_url = "https://raw.githubusercontent.com/joachimdero/toolboxScriptsQgis/refs/heads/master/toolboxLocatieservices2/modulesFromGithub.json"
-        with urllib.request.urlopen(raw_url) as response:
-            modules = json.load(response)
-        return modules
+def download_met_cache(naam, url, local_path, manifest, ttl=MODULE_CACHE_TTL, offline=False, feedback=None):
+    """
+    Haal url op naar local_path via de module cache en geef de SHA-256 van de lokale kopie terug.
+    - binnen de TTL of in offline modus: geen netwerk, enkel een stat van de lokale kopie
+    - anders: conditionele GET (If-None-Match / If-Modified-Since), 304 => lokale kopie blijft
+    - netwerkfout met bestaande lokale kopie: lokale kopie gebruiken
+    """
+    entry = manifest.get(naam, {})
+    aanwezig = os.path.exists(local_path)
+    geldig = aanwezig and entry.get("url") == url and "sha256" in entry
+
+    if geldig and (offline or time.time() - entry.get("gecontroleerd", 0) < ttl):
+        return entry["sha256"]
+    if offline:
+        if aanwezig:
+            return _sha256_bestand(local_path)
+        raise RuntimeError(f"Offline modus: geen lokale kopie van {naam} in {CACHE_DIR}")
+
+    request = urllib.request.Request(url)
+    if geldig:
+        if entry.get("etag"):
+            request.add_header("If-None-Match", entry["etag"])
+        if entry.get("last_modified"):
+            request.add_header("If-Modified-Since", entry["last_modified"])
+
+    try:
+        with urllib.request.urlopen(request) as response:
+            inhoud = response.read()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code != 304 or not geldig:
+            raise
+        # Niet gewijzigd: enkel tijdstip van controle bijwerken
+        entry["gecontroleerd"] = time.time()
+        return entry["sha256"]
+    except urllib.error.URLError as e:
+        if not aanwezig:
+            raise
+        if feedback:
+            feedback.reportError(f"{naam} niet bereikbaar ({e}), gecachte kopie wordt gebruikt", fatalError=False)
+        # manifest ongewijzigd laten: een entry van een andere url hoort niet bij deze kopie
+        return entry["sha256"] if geldig else _sha256_bestand(local_path)
+
+    sha256 = hashlib.sha256(inhoud).hexdigest()
+    if not aanwezig or sha256 != entry.get("sha256"):
+        tmp_pad = f"{local_path}.{os.getpid()}.tmp"
+        with open(tmp_pad, "wb") as f:
+            f.write(inhoud)
+        os.replace(tmp_pad, local_path)
+
+    manifest[naam] = {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "sha256": sha256,
+        "gecontroleerd": time.time(),
+    }
+    return sha256
 
-    modules = load_json_modules()
-    cache_dir = os.path.join(os.path.expanduser("~"), ".qgis_module_cache")
-    os.makedirs(cache_dir, exist_ok=True)
+
+def load_module_from_github(feedback=None, ttl=MODULE_CACHE_TTL, offline=False, modules=None):
+    """
+    Laad de modules uit modulesFromGithub.json via de module cache, of enkel modules ({naam: url}):
+    zo ververst ook de toolbox-tool deze module zelf. Geeft {naam: module} van de geladen modules.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
     # Voeg cache_dir één keer toe aan sys.path
-    if cache_dir not in sys.path:
-        sys.path.append(cache_dir)
-
-    loaded_modules = {}
-    for module_name, url in modules.items():
-        feedback.pushInfo(f"Bezig met laden van module: {module_name} van {url}")
-        local_path = os.path.join(cache_dir, module_name + ".py")
-        urllib.request.urlretrieve(url, local_path)
-        try:
-            # Gebruik importlib voor herladen als module al bestaat
-            if module_name in sys.modules:
-                module = importlib.reload(sys.modules[module_name])
-            else:
-                module = importlib.import_module(module_name)
-            loaded_modules[module_name] = module
-            if feedback:
-                feedback.pushInfo(f"Geladen: {module_name}")
-        except Exception as e:
-            if feedback:
-                feedback.reportError(f"Fout bij importeren {module_name}: {e}", fatalError=False)
+    if CACHE_DIR not in sys.path:
+        sys.path.append(CACHE_DIR)
+
+    manifest = _lees_manifest()
+    try:
+        if modules is None:
+            modules_json = os.path.join(CACHE_DIR, "modulesFromGithub.json")
+            download_met_cache("modulesFromGithub.json", MODULES_JSON_URL, modules_json, manifest, ttl, offline, feedback)
+            with open(modules_json, encoding="utf-8") as f:
+                modules = json.load(f)
+
+        loaded_modules = {}
+        for module_name, url in modules.items():
+            local_path = os.path.join(CACHE_DIR, module_name + ".py")
+            try:
+                sha256 = download_met_cache(module_name, url, local_path, manifest, ttl, offline, feedback)
+                module = sys.modules.get(module_name)
+                if module is not None and getattr(module, "__cache_sha256__", None) == sha256:
+                    # Inhoud ongewijzigd: geen reload nodig
+                    loaded_modules[module_name] = module
+                    continue
+
+                if feedback:
+                    feedback.pushInfo(f"Bezig met laden van module: {module_name} van {url}")
+                importlib.invalidate_caches()
+                # Gebruik importlib voor herladen als module al bestaat
+                if module is not None:
+                    module = importlib.reload(module)
+                else:
+                    module = importlib.import_module(module_name)
+                module.__cache_sha256__ = sha256
+                loaded_modules[module_name] = module
+                if feedback:
+                    feedback.pushInfo(f"Geladen: {module_name}")
+            except Exception as e:
+                if feedback:
+                    feedback.reportError(f"Fout bij importeren {module_name}: {e}", fatalError=False)
+    finally:
+        _schrijf_manifest(manifest)
     return loaded_modules
 
 
-def maak_json_locatie(feedback, layer, req, crs_id, f_subset, idx_wegnummer, geom_type):
-    locaties = []
+class FidStroom:
+    """
+    Levert fids lui in de volgorde van de provider, uit één enkele request zonder geometrie of
+    attributen en zonder filter of sortering (die niet elke provider kan vertalen).
+    Zo vertrekt de eerste chunk meteen en blijft het geheugen constant, ongeacht de laaggrootte.
+    Met fids (bv. de selectie) wordt enkel over die (gesorteerde) fids gelopen.
+    geleverd telt de reeds geleverde fids; een hervatte run slaat er overslaan over.
+    """
+
+    def __init__(self, layer, overslaan=0, fids=None, sorteer=True):
+        if fids is not None:
+            # sorteer=False: volgorde van fids behouden (bv. gegroepeerd per wegnummer)
+            bron = iter(sorted(fids) if sorteer else fids)
+        else:
+            req = QgsFeatureRequest().setFlags(NO_GEOMETRY).setNoAttributes()
+            bron = (feature.id() for feature in layer.getFeatures(req))
+        self.bron = islice(bron, overslaan, None)
+        self.geleverd = overslaan
+
+    def volgende(self, aantal):
+        """Geef de volgende (hoogstens) aantal fids; lege lijst als alles geleverd is."""
+        fids = list(islice(self.bron, aantal))
+        self.geleverd += len(fids)
+        return fids
+
+
+def fids_per_wegnummer(layer, idx_wegnummer, fids=None):
+    """
+    Geef de fids (alle, of enkel fids) gegroepeerd per wegnummer en daarbinnen oplopend,
+    zodat opeenvolgende chunks zoveel mogelijk op dezelfde weg liggen. Zonder wegnummer achteraan.
+    """
+    req = QgsFeatureRequest().setFlags(NO_GEOMETRY).setSubsetOfAttributes([idx_wegnummer])
+    if fids is not None:
+        req.setFilterFids(list(fids))
+    groepen = {}
+    for feature in layer.getFeatures(req):
+        waarde = feature[idx_wegnummer]
+        groepen.setdefault(None if waarde in (None, "") else str(waarde), []).append(feature.id())
+    volgorde = sorted(groepen, key=lambda wegnummer: (wegnummer is None, wegnummer or ""))
+    return [fid for wegnummer in volgorde for fid in sorted(groepen[wegnummer])]
+
+
+def gebruikt_kant_van_de_weg(waarde):
+    """True als 'gebruik kant van de weg' aan staat (index in KANT_VAN_DE_WEG, bool of tekst)."""
+    if isinstance(waarde, bool):
+        return waarde
+    if isinstance(waarde, str):
+        return waarde.strip().lower() == "true"
+    return KANT_VAN_DE_WEG[int(waarde or 0)] == "true"
+
+
+def afstand_decimalen(veld):
+    """
+    Afrondingsprecisie van de lokale afstand, zodat die weggeschreven wordt zoals een LS2-afstand in
+    hetzelfde veld: 0 voor een geheel getal, de precisie van een decimaal veld, anders None (niet afronden).
+    """
+    if veld.typeName().lower() in ("int", "integer", "integer64", "int2", "int4", "int8", "smallint", "bigint"):
+        return 0
+    return veld.precision() or None
+
+
+def _aanvaardt_argument(functie, naam):
+    """True als functie een argument naam (of **kwargs) aanvaardt."""
+    try:
+        parameters = inspect.signature(functie).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.name == naam or p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters)
+
+
+_CRS_BLOKKEN = {}
+
+
+def maak_crs_blok(crs_id):
+    """Geef het (gedeelde) CRS-blok voor crs_id; elke locatie verwijst naar hetzelfde object."""
+    crs_blok = _CRS_BLOKKEN.get(crs_id)
+    if crs_blok is None:
+        crs_blok = _CRS_BLOKKEN[crs_id] = {"type": "name", "properties": {"name": crs_id}}
+    return crs_blok
+
+
+def eindpunten(geom):
+    """
+    Geef [(deel, eindpunt, x, y)] van een geometrie.
+    Leest via constGet() enkel startPoint()/endPoint() per deel, i.p.v. met
+    asPolyline()/asMultiPolyline() elke vertex als QgsPointXY te kopiëren.
+    Werkt ook voor curves (CircularString, CompoundCurve) en Z/M-geometrieën.
+    """
+    abstract = geom.constGet()
+    if isinstance(abstract, QgsGeometryCollection):
+        delen = [abstract.geometryN(i) for i in range(abstract.numGeometries())]
+    else:
+        delen = [abstract]
+
+    punten = []
+    for deel, onderdeel in enumerate(delen):
+        if onderdeel is None or onderdeel.isEmpty():
+            continue
+        if isinstance(onderdeel, QgsCurve):
+            begin = onderdeel.startPoint()
+            eind = onderdeel.endPoint()
+            punten.append((deel, BEGIN, begin.x(), begin.y()))
+            punten.append((deel, EIND, eind.x(), eind.y()))
+        elif isinstance(onderdeel, QgsPoint):
+            punten.append((deel, PUNT, onderdeel.x(), onderdeel.y()))
+        # Andere geometrieën (Polygon) worden niet behandeld; leeg laten
+    return punten
+
+
+def maak_json_locatie(feedback, layer, req, crs_id, f_subset, idx_wegnummer, geom_type,
+                      idx_resultaat=None, ongewijzigd=None, alle_features=False, stuur_wegnummer=True):
+    """
+    Lees de features van req één keer en geef (locaties, records) terug.
+    locaties is een CompacteLocaties (kolommen fid, deel, eindpunt, x, y, wegnummer); de
+    LS2-JSON wordt pas aan de transportgrens opgebouwd. locaties.indices() geeft per locatie
+    (fid, deel, eindpunt), met eindpunt BEGIN/EIND/PUNT.
+    records bevat per feature met punten een FeatureRecord(fid, punten, wegnummer).
+    Incrementeel: features waarvan alle velden in idx_resultaat gevuld zijn en waarvoor
+    ongewijzigd(fid, punten) True geeft, worden overgeslagen.
+    alle_features (sink-modus): elke feature krijgt een record met de volledige QgsFeature,
+    ook als er geen punten naar LS2 gaan (lege geometrie, ongewijzigd).
+    stuur_wegnummer: het wegnummer van de feature (indien gekend) meesturen als zoekbeperking.
+    """
+    locaties = CompacteLocaties(crs_id)
+    records = []
     for i, row in enumerate(layer.getFeatures(req)):
+        feature = row if alle_features else None
         geom = row.geometry()
         if not geom or geom.isEmpty():
             # sla lege geometrieën over
+            if alle_features:
+                records.append(FeatureRecord(row.id(), [], None, feature))
             continue
 
-        # ✅ Robuust vertices ophalen per geometrietype (zonder vertexCount)
-        punten = []
-        if 'MultiLineString' in geom_type:
-            # MultiLineString: lijst van lijnen (elke lijn is lijst van QgsPoint)
-            mlines = geom.asMultiPolyline()
-            for line in mlines:
-                if len(line) > 0:
-                    # start- en eindpunt van elke deel-lijn
-                    punten.append(line[0])
-                    punten.append(line[-1])
-        elif 'LineString' in geom_type:
-            # LineString: enkele lijn als lijst van QgsPoint
-            line = geom.asPolyline()
-            if len(line) > 0:
-                punten = [line[0], line[-1]]
-        elif 'Point' in geom_type:
-            # Optioneel: puntenlagen ondersteunen
-            try:
-                pt = geom.asPoint()
-                # pt is QgsPoint, voeg toe als een enkel punt
-                punten = [pt]
-            except Exception:
-                punten = []
-        else:
-            # Andere geometrieën (Polygon/Multipart) niet behandeld in jouw script; leeg laten
-            punten = []
+        # ✅ Enkel begin- en eindpunt per deel, zonder alle vertices te kopiëren
+        punten = eindpunten(geom)
+
+        if not punten:
+            if alle_features:
+                records.append(FeatureRecord(row.id(), [], None, feature))
+            continue
 
         # ✅ Bouw locaties op voor elk punt
+        attributen = row.attributes()
+        waarde = attributen[idx_wegnummer] if idx_wegnummer != -1 else None
+        wegnummer = None if waarde in (None, "") else str(waarde)
+        if not stuur_wegnummer or wegnummer == "NULL":
+            wegnummer = None
+        coords = tuple((x, y) for _, _, x, y in punten)
 
-        for punt in punten:
-            x, y = punt.x(), punt.y()
-            waarde = row.attributes()[idx_wegnummer]
-            wegnummer = None if waarde in (None, "") else str(waarde)
-
-            locatie = {
-                "geometry": {
-                    "crs": {"type": "name", "properties": {"name": crs_id}},
-                    "type": "Point",
-                    "coordinates": [x, y]
-                }
-            }
-            if wegnummer not in (None, "NULL", "", ):
-                if wegnummer is None:
-                    locatie["wegnummer"] = {"nummer": wegnummer}
-            locaties.append(locatie)
+        if ongewijzigd is not None and all(i != -1 and attributen[i] not in (None, "") for i in idx_resultaat):
+            if ongewijzigd(row.id(), coords):
+                if alle_features:
+                    records.append(FeatureRecord(row.id(), [], waarde, feature))
+                continue
 
-    return locaties
+        records.append(FeatureRecord(row.id(), coords, waarde, feature))
 
-def add_locatie_fields(layer, geom_type, f_wegnummer, feedback):
-    try:
-        from Locatieservices2 import F_TYPE
-    except Exception:
-        F_TYPE = {}
+        for deel, eindpunt, x, y in punten:
+            locaties.voeg_toe(row.id(), deel, eindpunt, x, y, wegnummer)
 
-    if f_wegnummer in (None, ''):
-        f_wegnummer = "wegnummer"
+    return locaties, records
 
-    feedback.pushInfo(f"f_wegnummer (add_locatie_fields): {str(f_wegnummer)}")
 
-    if 'LineString' in geom_type:
-        fields_to_add = [
-            f_wegnummer,
+def ontdubbel_locaties(locaties, crs_id, tolerantie=0.0):
+    """
+    Voeg locaties (CompacteLocaties) met hetzelfde wegnummer samen die hoogstens tolerantie
+    (kaarteenheden, zie tolerantie_in_kaarteenheden) van een reeds gekozen locatie liggen; 0 = exact gelijk.
+    De buurcellen van het raster worden mee doorzocht, zodat punten vlak bij een celgrens niet gesplitst worden.
+    Geeft (unieke_locaties, verwijzingen) terug: verwijzingen[i] is de index in
+    unieke_locaties die het resultaat voor locaties[i] levert.
+    """
+    posities = array("i")
+    verwijzingen = array("i")
+    index = {}  # (x, y, wegnummer_id) of (cel_x, cel_y, wegnummer_id) -> index(en) in unieke_locaties
+    kwadraat = tolerantie * tolerantie
+    for i, (x, y, wegnummer_id) in enumerate(zip(locaties.x, locaties.y, locaties.wegnummer_id)):
+        if tolerantie <= 0:
+            sleutel = (x, y, wegnummer_id)
+            uniek = index.get(sleutel)
+            if uniek is None:
+                uniek = index[sleutel] = len(posities)
+                posities.append(i)
+            verwijzingen.append(uniek)
+            continue
+
+        cel_x, cel_y = math.floor(x / tolerantie), math.floor(y / tolerantie)
+        uniek = None
+        for buur_x in (cel_x - 1, cel_x, cel_x + 1):
+            for buur_y in (cel_y - 1, cel_y, cel_y + 1):
+                for kandidaat in index.get((buur_x, buur_y, wegnummer_id), ()):
+                    positie = posities[kandidaat]
+                    if (locaties.x[positie] - x) ** 2 + (locaties.y[positie] - y) ** 2 <= kwadraat:
+                        uniek = kandidaat
+                        break
+                if uniek is not None:
+                    break
+            if uniek is not None:
+                break
+        if uniek is None:
+            uniek = len(posities)
+            posities.append(i)
+            index.setdefault((cel_x, cel_y, wegnummer_id), []).append(uniek)
+        verwijzingen.append(uniek)
+    return locaties.selectie(posities), verwijzingen
+
+
+def verdeel_responses(responses, verwijzingen):
+    """Zet de responses van de unieke locaties terug naar één response per oorspronkelijke locatie."""
+    responses = responses or []
+    return [responses[i] if i < len(responses) else None for i in verwijzingen]
+
+
+class Ls2ResultaatCache:
+    """
+    Persistente SQLite-cache van LS2-puntlocatie responses (naast de module cache).
+    Sleutel: (coördinaat, crs, zoekafstand, gebruik_kant_van_de_weg, wegnummer, OMGEVING).
+    Enkel te gebruiken vanop de hoofdthread.
+    """
+
+    def __init__(self, pad=None, max_aantal=1000000, max_leeftijd_dagen=30):
+        pad = pad or RESULTAAT_CACHE_PAD
+        os.makedirs(os.path.dirname(pad), exist_ok=True)
+        self.conn = sqlite3.connect(pad)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS resultaten "
+            "(sleutel TEXT PRIMARY KEY, response TEXT NOT NULL, tijdstip REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_resultaten_tijdstip ON resultaten (tijdstip)")
+        self.conn.commit()
+        self.max_aantal = max_aantal
+        self.max_leeftijd = max_leeftijd_dagen * 86400
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def sleutel(locatie, crs_id, zoekafstand, gebruik_kant_van_de_weg, omgeving=OMGEVING, wegtype=None):
+        x, y = locatie["geometry"]["coordinates"]
+        wegnummer = locatie.get("wegnummer", {}).get("nummer")
+        return Ls2ResultaatCache.sleutel_xy(
+            x, y, wegnummer, crs_id, zoekafstand, gebruik_kant_van_de_weg, omgeving, wegtype)
+
+    @staticmethod
+    def sleutel_xy(x, y, wegnummer, crs_id, zoekafstand, gebruik_kant_van_de_weg, omgeving=OMGEVING, wegtype=None):
+        """Zelfde sleutel als sleutel(), rechtstreeks uit de kolommen van CompacteLocaties."""
+        waarden = [round(x, 6), round(y, 6), crs_id, zoekafstand, gebruik_kant_van_de_weg, wegnummer, omgeving]
+        if wegtype is not None:
+            # enkel toevoegen als er gefilterd wordt: bestaande sleutels blijven geldig
+            waarden.append(wegtype)
+        return hashlib.sha1(json.dumps(waarden).encode("utf-8")).hexdigest()
+
+    def haal_op(self, sleutels):
+        """Geef {sleutel: response} voor de sleutels die (nog niet verlopen) in de cache zitten."""
+        gevonden = {}
+        min_tijdstip = time.time() - self.max_leeftijd
+        uniek = list(set(sleutels))
+        for start in range(0, len(uniek), 500):  # SQLite limiet op het aantal parameters
+            deel = uniek[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT sleutel, response FROM resultaten WHERE tijdstip >= ? "
+                f"AND sleutel IN ({','.join('?' * len(deel))})",
+                [min_tijdstip, *deel])
+            for sleutel, response in rows:
+                gevonden[sleutel] = json.loads(response)
+        self.hits += len(gevonden)
+        self.misses += len(uniek) - len(gevonden)
+        return gevonden
+
+    def bewaar(self, items):
+        """items: iterable van (sleutel, response)."""
+        nu = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO resultaten (sleutel, response, tijdstip) VALUES (?, ?, ?)",
+            [(sleutel, json.dumps(response), nu) for sleutel, response in items])
+        self.conn.commit()
+
+    def ruim_op(self):
+        """Verwijder verlopen resultaten en de oudste resultaten boven max_aantal."""
+        self.conn.execute("DELETE FROM resultaten WHERE tijdstip < ?", (time.time() - self.max_leeftijd,))
+        self.conn.execute(
+            "DELETE FROM resultaten WHERE sleutel IN "
+            "(SELECT sleutel FROM resultaten ORDER BY tijdstip DESC LIMIT -1 OFFSET ?)",
+            (self.max_aantal,))
+        self.conn.commit()
+
+    def sluit(self):
+        self.conn.close()
+
+
+class IncrementeleStatus:
+    """
+    Geometrie-hash per fid van de vorige run, bewaard als sidecar-tabel in de resultaat cache.
+    Een feature is ongewijzigd als de hash van zijn eindpunten (en de LS2-parameters) gelijk is.
+    """
+
+    def __init__(self, laag_sleutel, parameters_sleutel="", pad=None):
+        pad = pad or RESULTAAT_CACHE_PAD
+        os.makedirs(os.path.dirname(pad), exist_ok=True)
+        self.conn = sqlite3.connect(pad)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS geometrie_status "
+            "(laag TEXT NOT NULL, fid INTEGER NOT NULL, hash TEXT NOT NULL, tijdstip REAL NOT NULL, "
+            "PRIMARY KEY (laag, fid))")
+        self.conn.commit()
+        self.laag = hashlib.sha1(laag_sleutel.encode("utf-8")).hexdigest()
+        self.parameters_sleutel = parameters_sleutel
+        self.vorige = {}
+        self.overgeslagen = 0
+
+    def geometrie_hash(self, punten):
+        waarden = [self.parameters_sleutel, [[round(x, 6), round(y, 6)] for x, y in punten]]
+        return hashlib.sha1(json.dumps(waarden).encode("utf-8")).hexdigest()
+
+    def laad(self, fids):
+        """Haal de hashes van de vorige run op voor de fids van één chunk."""
+        self.vorige = {}
+        fids = list(fids)
+        for start in range(0, len(fids), 500):  # SQLite limiet op het aantal parameters
+            deel = fids[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT fid, hash FROM geometrie_status WHERE laag = ? AND fid IN ({','.join('?' * len(deel))})",
+                [self.laag, *deel])
+            self.vorige.update(rows)
+
+    def ongewijzigd(self, fid, punten):
+        if self.vorige.get(fid) == self.geometrie_hash(punten):
+            self.overgeslagen += 1
+            return True
+        return False
+
+    def bewaar(self, records):
+        nu = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO geometrie_status (laag, fid, hash, tijdstip) VALUES (?, ?, ?, ?)",
+            [(self.laag, record.fid, self.geometrie_hash(record.punten), nu) for record in records])
+        self.conn.commit()
+
+    def sluit(self):
+        self.conn.close()
+
+
+class Ls2Opname:
+    """
+    Append-only, gzip-gecomprimeerde opname van het LS2-verkeer: per request één JSON-regel
+    {chunk, hash, locaties, responses}. Elke chunk wordt als apart gzip-lid toegevoegd, zodat
+    een afgebroken run het bestand niet onleesbaar maakt en een volgende run kan aanvullen.
+    Afspelen zoekt eerst op payload-hash (zelfde chunks), anders per locatie (andere chunkgrootte).
+    """
+
+    def __init__(self, pad):
+        self.pad = pad
+        self.per_hash = {}
+        self.per_locatie = {}
+        self.opgenomen = 0
+        self.afgespeeld = 0
+        self.missers = 0
+
+    @staticmethod
+    def payload_hash(locaties):
+        # compacte JSON zonder ASCII-escapes, in blokken gehasht: zelfde hash als oudere opnames
+        h = hashlib.sha256()
+        for blok in json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).iterencode(locaties):
+            h.update(blok.encode("utf-8"))
+        return h.hexdigest()
+
+    @staticmethod
+    def _locatie_sleutel(locatie):
+        return json.dumps(locatie, sort_keys=True, separators=(",", ":"))
+
+    def neem_op(self, chunk_nr, locaties, responses):
+        regel = json.dumps({
+            "chunk": chunk_nr,
+            "hash": self.payload_hash(locaties),
+            "locaties": locaties,
+            "responses": responses,
+        }, separators=(",", ":"))
+        with gzip.open(self.pad, "at", encoding="utf-8") as f:
+            f.write(regel + "\n")
+        self.opgenomen += 1
+
+    def laad(self):
+        try:
+            with gzip.open(self.pad, "rt", encoding="utf-8") as f:
+                for regel in f:
+                    item = json.loads(regel)
+                    self.per_hash[item["hash"]] = item["responses"]
+                    for locatie, response in zip(item["locaties"], item["responses"]):
+                        self.per_locatie[self._locatie_sleutel(locatie)] = response
+        except (EOFError, ValueError):
+            # afgebroken laatste chunk (bv. run gestopt tijdens het schrijven): de rest is bruikbaar
+            pass
+        return self
+
+    def speel_af(self, locaties):
+        responses = self.per_hash.get(self.payload_hash(locaties))
+        if responses is None:
+            responses = [self.per_locatie.get(self._locatie_sleutel(locatie)) for locatie in locaties]
+            self.missers += responses.count(None)
+        self.afgespeeld += 1
+        return responses
+
+
+def resultaat_velden(geom_type):
+    """Namen van de velden die met LS2-resultaten gevuld worden (zonder wegnummer)."""
+    if is_lijn(geom_type):
+        return [
             "begin_refpunt_wegnr", "begin_refpunt_opschrift", "begin_refpunt_afstand",
             "eind_refpunt_wegnr", "eind_refpunt_opschrift", "eind_refpunt_afstand"
         ]
-    else:
-        fields_to_add = [
-            f_wegnummer,
-            "refpunt_wegnr", "refpunt_opschrift", "refpunt_afstand"
-        ]
+    return ["refpunt_wegnr", "refpunt_opschrift", "refpunt_afstand"]
+
 
-    # QGIS 4 / Qt6 gebruikt QMetaType i.p.v. int(QVariant.*)
+class AdaptieveBatchGrootte:
+    """
+    Stuurt het aantal features per chunk bij op basis van de gemeten responstijd per locatie
+    en van fouten/timeouts van request_ls2_puntlocatie. maximum is de door de gebruiker
+    opgegeven bovengrens ('aantal elementen per request').
+    """
+
+    def __init__(self, maximum, start=250, minimum=10, doel_seconden=10.0):
+        self.maximum = max(1, int(maximum))
+        self.minimum = min(minimum, self.maximum)
+        self.grootte = min(start, self.maximum)
+        self.doel_seconden = doel_seconden
+        # zakt na een fout, zodat niet meteen terug naar een falende grootte gegroeid wordt;
+        # groeit na elke geslaagde chunk weer geleidelijk naar maximum
+        self.plafond = self.maximum
+
+    def registreer(self, aantal_features, aantal_locaties, seconden, gesplitst=False):
+        """Verwerk de meting van één chunk en geef de nieuwe chunkgrootte terug."""
+        if gesplitst:
+            # fouten/timeouts: chunk was te groot voor LS2, halveren
+            self.plafond = max(self.minimum, self.grootte - 1)
+            self.grootte = max(self.minimum, self.grootte // 2)
+            return self.grootte
+        self.plafond = min(self.maximum, self.plafond + max(1, self.plafond // 4))
+        if aantal_features and aantal_locaties and seconden > 0:
+            seconden_per_feature = seconden / aantal_locaties * (aantal_locaties / aantal_features)
+            ideaal = self.doel_seconden / seconden_per_feature
+            # gedempt bijsturen: hoogstens verdubbelen of halveren per chunk
+            nieuw = (self.grootte + ideaal) / 2
+            nieuw = min(max(nieuw, self.grootte / 2), self.grootte * 2)
+            self.grootte = int(min(max(nieuw, self.minimum), self.plafond))
+        return self.grootte
+
+
+def _request_met_retry(Ls2, locaties, request_kwargs, pogingen=3, wachttijd=RETRY_WACHTTIJD):
+    """Roep LS2 aan en probeer opnieuw met exponentiële backoff + jitter bij een exception (bv. 5xx)."""
+    for poging in range(pogingen):
+        try:
+            return Ls2.request_ls2_puntlocatie(locaties=locaties, **request_kwargs)
+        except Exception as e:
+            if is_auth_fout(e):
+                # verlopen/ongeldige sessie: transparant een nieuwe opbouwen en opnieuw proberen
+                nieuwe_sessie = vernieuw_sessie(request_kwargs.get("session"))
+                if nieuwe_sessie is not None:
+                    request_kwargs["session"] = nieuwe_sessie
+            if poging == pogingen - 1:
+                raise
+            time.sleep(wachttijd * 2 ** poging * random.uniform(0.5, 1.5))
+
+
+def vraag_volledig(Ls2, locaties, request_kwargs, pogingen=3, wachttijd=RETRY_WACHTTIJD):
+    """
+    Vraag LS2 voor alle locaties en controleer dat er evenveel responses als locaties terugkomen.
+    Ontbrekende posities (te korte lijst of None) worden opnieuw gevraagd, enkel voor die indices.
+    Geeft altijd een lijst met len(locaties) elementen terug (None = geen antwoord).
+    """
+    responses = list(_request_met_retry(Ls2, locaties, request_kwargs, pogingen, wachttijd) or [])
+    responses = responses[:len(locaties)] + [None] * (len(locaties) - len(responses))
+
+    for poging in range(pogingen - 1):
+        ontbrekend = [i for i, response in enumerate(responses) if response is None]
+        if not ontbrekend:
+            break
+        time.sleep(wachttijd * 2 ** poging * random.uniform(0.5, 1.5))
+        extra = _request_met_retry(Ls2, [locaties[i] for i in ontbrekend], request_kwargs, pogingen, wachttijd)
+        for i, response in zip(ontbrekend, extra or []):
+            responses[i] = response
+    return responses
+
+
+def _splitsing_mislukt(e, locaties, min_locaties, toestand):
+    """
+    Beslis na een mislukt (deel)request van request_met_splitsing: True = verder splitsen,
+    False = blad opgeven (None-antwoorden, gemeld via FoutVerzamelaar). Een auth-fout of een storing
+    over de hele chunk (STORING_NA_FOUTEN mislukte bladen en nog geen enkel succes) wordt doorgegeven.
+    """
+    if is_auth_fout(e):
+        raise e
+    if len(locaties) > min_locaties:
+        return True
+    toestand["fouten"] += 1
+    if not toestand["gelukt"] and (toestand["fouten"] >= STORING_NA_FOUTEN or toestand["bovenste"] is locaties):
+        raise e
+    return False
+
+
+def request_met_splitsing(Ls2, locaties, request_kwargs, min_locaties=1, pogingen=3, toestand=None):
+    """
+    Roep LS2 aan via vraag_volledig (in een worker-thread) en meet de duur.
+    Mislukt een te grote batch ook na de retries, dan wordt die in twee gesplitst en
+    opnieuw gevraagd i.p.v. de hele chunk te verliezen; een blad van min_locaties dat blijft
+    mislukken krijgt None-antwoorden. Geeft (responses, seconden, gesplitst) terug.
+    """
+    begin = time.monotonic()
+    if toestand is None:
+        toestand = {"gelukt": 0, "fouten": 0, "bovenste": locaties}
     try:
-        from qgis.PyQt.QtCore import QMetaType
+        responses = vraag_volledig(Ls2, locaties, request_kwargs, pogingen)
+        toestand["gelukt"] += 1
+        return responses, time.monotonic() - begin, False
+    except Exception as e:
+        if not _splitsing_mislukt(e, locaties, min_locaties, toestand):
+            return [None] * len(locaties), time.monotonic() - begin, True
+    midden = len(locaties) // 2
+    links, _, _ = request_met_splitsing(Ls2, locaties[:midden], request_kwargs, min_locaties, pogingen, toestand)
+    rechts, _, _ = request_met_splitsing(Ls2, locaties[midden:], request_kwargs, min_locaties, pogingen, toestand)
+    return links + rechts, time.monotonic() - begin, True
 
-        TYPE_STRING = QMetaType.Type.QString
-        TYPE_DOUBLE = QMetaType.Type.Double
-        TYPE_INT = QMetaType.Type.Int
 
-        feedback.pushInfo("Gebruik QMetaType veldtypes voor QGIS/Qt6.")
+def _checkpoint_pad(layer):
+    return os.path.join(CHECKPOINT_DIR, hashlib.sha1(layer.source().encode("utf-8")).hexdigest() + ".json")
 
+
+def checkpoint_sleutel(layer, selectie):
+    """Beschrijft de fids waarover gelopen wordt; een checkpoint geldt enkel voor dezelfde sleutel."""
+    if selectie is None:
+        return f"alle:{layer.featureCount()}"
+    return "selectie:" + hashlib.sha1(",".join(map(str, sorted(selectie))).encode("ascii")).hexdigest()
+
+
+def lees_checkpoint(layer, sleutel):
+    """
+    Aantal fids (in de volgorde van FidStroom) dat in een vorige (onderbroken) run gecommit werd,
+    of 0 als er geen checkpoint is of de laag/selectie intussen veranderde.
+    """
+    try:
+        with open(_checkpoint_pad(layer), encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint["sleutel"] != sleutel:
+            return 0
+        return int(checkpoint["verwerkt"])
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def schrijf_checkpoint(layer, sleutel, verwerkt):
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    pad = _checkpoint_pad(layer)
+    with open(pad + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"bron": layer.source(), "sleutel": sleutel, "verwerkt": verwerkt, "tijdstip": time.time()}, f)
+    os.replace(pad + ".tmp", pad)
+
+
+def verwijder_checkpoint(layer):
+    try:
+        os.remove(_checkpoint_pad(layer))
+    except OSError:
+        pass
+
+
+def maak_locatie_fields(fields, geom_type, f_wegnummer, feedback):
+    """
+    Bepaal welke velden (volgens F_TYPE) nog ontbreken in fields.
+    Geeft (f_wegnummer, [QgsField, ...]) terug zonder de laag te wijzigen.
+    """
+    try:
+        from Locatieservices2 import F_TYPE
     except Exception:
-        # Fallback voor QGIS 3 / Qt5
-        from qgis.PyQt.QtCore import QVariant
+        F_TYPE = {}
 
-        TYPE_STRING = QVariant.String
-        TYPE_DOUBLE = QVariant.Double
-        TYPE_INT = QVariant.Int
+    if f_wegnummer in (None, ''):
+        f_wegnummer = "wegnummer"
 
-        feedback.pushInfo("Gebruik QVariant veldtypes voor QGIS/Qt5.")
+    feedback.pushInfo(f"f_wegnummer (add_locatie_fields): {str(f_wegnummer)}")
+
+    fields_to_add = [f_wegnummer] + resultaat_velden(geom_type)
+
+    feedback.pushInfo(f"Gebruik {VELDTYPES} veldtypes.")
 
     def normalize_field_type(raw_type):
         """
@@ -180,7 +1014,7 @@ def add_locatie_fields(layer, geom_type, f_wegnummer, feedback):
     new_fields = []
 
     for fname in fields_to_add:
-        if layer.fields().indexFromName(fname) != -1:
+        if fields.indexFromName(fname) != -1:
             continue
 
         spec = F_TYPE.get(fname)
@@ -239,9 +1073,15 @@ def add_locatie_fields(layer, geom_type, f_wegnummer, feedback):
                     # Laatste fallback: stringveld
                     fld = QgsField(str(fname), TYPE_STRING)
 
-        if layer.fields().indexFromName(fname) == -1:
+        if fields.indexFromName(fname) == -1:
             new_fields.append(fld)
 
+    return f_wegnummer, new_fields
+
+
+def add_locatie_fields(layer, geom_type, f_wegnummer, feedback):
+    f_wegnummer, new_fields = maak_locatie_fields(layer.fields(), geom_type, f_wegnummer, feedback)
+
     if new_fields:
         dp = layer.dataProvider()
 
@@ -275,7 +1115,7 @@ def z_add_locatie_fields(layer, geom_type, f_wegnummer, feedback):
     if f_wegnummer in (None, ''):
         f_wegnummer = "wegnummer"
     print(f"f_wegnummer (add_locatie_fields):{str(f_wegnummer)}")
-    if 'LineString' in geom_type:
+    if is_lijn(geom_type):
         fields_to_add = [
             f_wegnummer,
             "begin_refpunt_wegnr", "begin_refpunt_opschrift", "begin_refpunt_afstand",
@@ -375,27 +1215,119 @@ def _extract_refpunt_values(response, feedback=None):
         wegnummer = relatief["wegnummer"]["nummer"]
         return wegnummer, referentiepunt_wegnr, opschrift, afstand
     except Exception:
-        feedback.pushInfo(f"_extract_refpunt_values mislukt:{str(response)}")
+        if feedback:
+            feedback.pushInfo(f"_extract_refpunt_values mislukt:{str(response)}")
         return None
 
 
-def schrijf_resultaten_naar_layer(layer, req, geom_type, f_wegnummer, responses=None, feedback=None):
+FOUT_GEEN_WEG = "geen weg binnen zoekafstand"
+FOUT_SERVICE = "servicefout"
+FOUT_ONLEESBAAR = "onleesbare response"
+FOUT_GEEN_ANTWOORD = "geen antwoord"
+
+
+def classificeer_fout(response):
+    """Deel een response zonder bruikbare 'success/relatief' in bij een foutklasse."""
+    if response is None:
+        return FOUT_GEEN_ANTWOORD
+    if not isinstance(response, dict):
+        return FOUT_ONLEESBAAR
+    fout = response.get("failure") or response.get("error") or response.get("fout")
+    if fout is None:
+        return FOUT_ONLEESBAAR
+    melding = (fout if isinstance(fout, str) else json.dumps(fout)).lower()
+    if any(woord in melding for woord in ("zoekafstand", "geen weg", "niet gevonden", "not found", "no road")):
+        return FOUT_GEEN_WEG
+    return FOUT_SERVICE
+
+
+class FoutVerzamelaar:
+    """
+    Verzamelt mislukte punten per foutklasse (histogram) i.p.v. elke response te loggen:
+    per klasse hoogstens max_voorbeelden regels in de feedback, de rest enkel geteld.
+    Met een sink worden de getroffen fids en eindpunten als punten weggeschreven
+    (laag 'mislukte features'), zodat die gericht opnieuw gedraaid kunnen worden.
+    """
+
+    def __init__(self, feedback=None, max_voorbeelden=5, sink=None, buffer_grootte=1000):
+        self.feedback = feedback
+        self.max_voorbeelden = max_voorbeelden
+        self.sink = sink
+        self.buffer_grootte = buffer_grootte
+        self.histogram = Counter()
+        # velden enkel nodig om features voor de sink te maken
+        self.fields = self.velden() if sink is not None else None
+        self._buffer = []
+
+    @staticmethod
+    def velden():
+        fields = QgsFields()
+        fields.append(QgsField("invoer_fid", TYPE_LONGLONG))
+        fields.append(QgsField("eindpunt", TYPE_STRING))
+        fields.append(QgsField("klasse", TYPE_STRING))
+        fields.append(QgsField("response", TYPE_STRING))
+        return fields
+
+    def registreer(self, response, fid, eindpunt, punt=None):
+        klasse = classificeer_fout(response)
+        self.histogram[klasse] += 1
+        if self.feedback and self.histogram[klasse] <= self.max_voorbeelden:
+            self.feedback.pushInfo(f"{klasse}: fid {fid} ({eindpunt}) {str(response)[:300]}")
+        if self.sink is not None and punt is not None:
+            feature = QgsFeature(self.fields)
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(*punt)))
+            feature.setAttributes([fid, eindpunt, klasse, str(response)[:254]])
+            self._buffer.append(feature)
+            if len(self._buffer) >= self.buffer_grootte:
+                self.flush()
+        return klasse
+
+    def flush(self):
+        if self.sink is not None and self._buffer:
+            self.sink.addFeatures(self._buffer, QgsFeatureSink.FastInsert)
+        self._buffer = []
+
+    def samenvatting(self):
+        if not self.feedback or not self.histogram:
+            return
+        regels = [f"{klasse:<32}{aantal:>10}" for klasse, aantal in self.histogram.most_common()]
+        self.feedback.pushInfo("mislukte punten per klasse:\n" + "\n".join(regels))
+
+
+def schrijf_resultaten_naar_layer(layer, records, geom_type, f_wegnummer, responses=None, feedback=None, indices=None,
+                                  schrijver=None, na_commit=None, fields=None, fouten=None):
     """
     Schrijf per feature LS2-resultaten naar de laag.
-    - Voor (Multi)LineString: verwacht 2 responses per feature (begin/eind).
+    - schrijver: AttribuutSchrijver die wijzigingen over chunks heen bundelt; zonder schrijver
+      worden de wijzigingen meteen weggeschreven. na_commit(fids) wordt opgeroepen zodra
+      de wijzigingen van deze chunk effectief in de provider staan.
+    - fields: velden waarop de veld-indices slaan (uitvoerlaag in sink-modus), standaard layer.fields().
+    - records: FeatureRecords uit maak_json_locatie (geen nieuwe leesronde op de laag)
+    - indices: (fid, deel, eindpunt) per response, bv. CompacteLocaties.indices().
+      Responses worden via deze index aan features gekoppeld, niet via hun volgorde.
+    - Voor lijnen (ook curves en multi-delen): begin van het eerste deel, eind van het laatste deel.
     - Voor andere types: 1 response per feature (algemene 'refpunt_*' velden).
+    - fouten: FoutVerzamelaar voor punten zonder bruikbaar antwoord (standaard een nieuwe per oproep).
+    Geeft de set van bijgewerkte fids terug.
     """
+    if fouten is None:
+        fouten = FoutVerzamelaar(feedback)
     if responses is None:
         responses = []
+    if indices is None:
+        indices = []
 
     # Bepaal hoeveel responses per feature nodig zijn
-    is_line = ('LineString' in geom_type)
+    is_line = is_lijn(geom_type)
 
-    # Maak een iterator over responses
-    resp_iter = iter(responses)
+    # Responses per feature groeperen: { fid: { (deel, eindpunt): response } }
+    per_fid = {}
+    for (fid, deel, eindpunt), response in zip(indices, responses):
+        per_fid.setdefault(fid, {})[(deel, eindpunt)] = response
 
     # Haal veld-indices één keer op
-    fields = layer.fields()
+    if fields is None:
+        fields = layer.fields()
     idx_wegnummer = fields.indexFromName(f_wegnummer)
 
     idx_ref_wegnr = fields.indexFromName("refpunt_wegnr")
@@ -432,96 +1364,622 @@ def schrijf_resultaten_naar_layer(layer, req, geom_type, f_wegnummer, responses=
     if missing:
         raise RuntimeError(f"Ontbrekende velden in laag: {', '.join(missing)}")
 
-    # Start edit-modus indien nodig
-    started = False
-    if not layer.isEditable():
-        layer.startEditing()
-        started = True
-
-    changes = {}  # { fid: { field_idx: value, ... }, ... }
-
-    # Itereer over features
-    for feat in layer.getFeatures(req):
-        attrs = {}
+    # kolommen: wegnummer + (begin, eind) of refpunt; de provider-map wordt pas bij flush opgebouwd
+    if is_line:
+        changes = CompacteWijzigingen((idx_wegnummer, idx_begin_wegnr, idx_begin_opschrift, idx_begin_afstand,
+                                       idx_eind_wegnr, idx_eind_opschrift, idx_eind_afstand))
+    else:
+        changes = CompacteWijzigingen((idx_wegnummer, idx_ref_wegnr, idx_ref_opschrift, idx_ref_afstand))
 
-        fields = layer.fields()
-        # pairs = [f"{i}:{fields[i].name()}={v}" for i, v in enumerate(feat.attributes())]
-        # feedback.pushInfo(" | ".join(pairs))
+    # Itereer over de records van deze chunk
+    for record in records:
+        if not record.punten:
+            # niets gevraagd (lege geometrie, ongewijzigd): geen resultaat en geen fout
+            continue
+        waarden = [NIET_GEZET] * len(changes.kolommen)
+        antwoorden = per_fid.get(record.fid, {})
 
         if is_line:
-            # BEGIN
-            r_begin = next(resp_iter, None)
-            relatieve_weglocatie_begin = _extract_refpunt_values(r_begin, feedback) if r_begin else None
+            # BEGIN (eerste deel met een begin; lege delen worden overgeslagen bij het lezen)
+            eerste_deel = min((deel for deel, eindpunt in antwoorden if eindpunt == BEGIN), default=0)
+            r_begin = antwoorden.get((eerste_deel, BEGIN))
+            relatieve_weglocatie_begin = _extract_refpunt_values(r_begin) if r_begin else None
             if relatieve_weglocatie_begin:
                 wegnummer, wegnr, opschrift, afstand = relatieve_weglocatie_begin
-                current_wegnummer = feat.attributes()[idx_wegnummer]
-
-                if current_wegnummer in (None, ''):
-                    attrs[idx_wegnummer] = wegnummer
 
-                attrs[idx_begin_wegnr] = wegnr
-                attrs[idx_begin_opschrift] = opschrift
-                attrs[idx_begin_afstand] = afstand
+                if record.wegnummer in (None, ''):
+                    waarden[0] = wegnummer
 
-                # if feedback: feedback.pushInfo(
-                #     f" geldige 'success/relatief' in begin-response: 1 {wegnr, opschrift, afstand}")
+                waarden[1:4] = wegnr, opschrift, afstand
             else:
-                if feedback: feedback.pushInfo(
-                    f"Geen geldige 'success/relatief' in begin-response: 1 {relatieve_weglocatie_begin}")
-
-            # EIND
-            r_eind = next(resp_iter, None)
-            # feedback.pushInfo(f"r_eind:{str(r_eind)}")
-            relatieve_weglocatie_eind = _extract_refpunt_values(r_eind, feedback) if r_eind else None
-            # feedback.pushInfo(f"relatieve_weglocatie_eind:{str(relatieve_weglocatie_eind)}")
-            # feedback.pushInfo(f"r_eind:{str(r_eind)}")
+                fouten.registreer(r_begin, record.fid, BEGIN, record.punten[0])
+
+            # EIND (laatste deel met een eind)
+            laatste_deel = max((deel for deel, eindpunt in antwoorden if eindpunt == EIND), default=0)
+            r_eind = antwoorden.get((laatste_deel, EIND))
+            relatieve_weglocatie_eind = _extract_refpunt_values(r_eind) if r_eind else None
             if relatieve_weglocatie_eind:
                 wegnummer, wegnr, opschrift, afstand = relatieve_weglocatie_eind
-                attrs[idx_eind_wegnr] = wegnr
-                attrs[idx_eind_opschrift] = opschrift
-                attrs[idx_eind_afstand] = afstand
+                waarden[4:7] = wegnr, opschrift, afstand
             else:
-                if feedback: feedback.pushInfo(
-                    f"Geen geldige 'success/relatief' in begin-response: 2 {relatieve_weglocatie_begin}")
+                fouten.registreer(r_eind, record.fid, EIND, record.punten[-1])
 
         else:
-            # Niet-line: 1 response per feature
-            r = next(resp_iter, None)
+            # Niet-line: 1 response per feature (bij multipoint het eerste deel)
+            eerste_deel = min((deel for deel, eindpunt in antwoorden if eindpunt == PUNT), default=0)
+            r = antwoorden.get((eerste_deel, PUNT))
             relatieve_weglocatie = _extract_refpunt_values(r) if r else None
             if relatieve_weglocatie:
                 wegnummer, wegnr, opschrift, afstand = relatieve_weglocatie
-                if attrs[idx_wegnummer] in (None, ''):
-                    attrs[idx_wegnummer] = wegnummer
-                attrs[idx_ref_wegnr] = wegnr
-                attrs[idx_ref_opschrift] = opschrift
-                attrs[idx_ref_afstand] = afstand
+                if record.wegnummer in (None, ''):
+                    waarden[0] = wegnummer
+                waarden[1:4] = wegnr, opschrift, afstand
             else:
-                if feedback: feedback.pushInfo(
-                    f"Geen geldige 'success/relatief' in eind-response: 3 {relatieve_weglocatie_begin}")
+                fouten.registreer(r, record.fid, PUNT, record.punten[0])
+
+        if any(waarde is not NIET_GEZET for waarde in waarden):
+            changes.voeg_toe(record.fid, waarden)
 
-        if attrs:
-            changes[feat.id()] = attrs
+    # Wegschrijven in één batch (of bundelen met volgende chunks)
+    if schrijver is None:
+        schrijver = AttribuutSchrijver(layer, feedback=feedback)
+        schrijver.voeg_toe(changes, na_commit, records)
+        schrijver.flush()
+    else:
+        schrijver.voeg_toe(changes, na_commit, records)
 
-    # Wegschrijven in één batch
-    if changes:
-        layer.dataProvider().changeAttributeValues(changes)
+    return set(changes)
 
-    # Commit
-    layer.updateFields()
-    if started:
-        layer.commitChanges()
 
-    if feedback:
-        feedback.pushInfo(f"Wrote results to layer ({len(changes)} features bijgewerkt)")
+def piek_rss_mb():
+    """Piek-geheugengebruik (RSS) van het proces in MB, of None als het niet bepaald kan worden."""
+    try:
+        import resource
+        piek = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux: kB, macOS: bytes
+        return piek / 1024 / 1024 if sys.platform == "darwin" else piek / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        # Windows kent een echte piekwaarde (peak_wset), elders enkel de huidige RSS
+        return getattr(info, "peak_wset", info.rss) / 1024 / 1024
+    except ImportError:
+        return None
+
+
+class RunStatistieken:
+    """
+    Meet per chunk de duur van elke fase (monotone klok) en telt punten, responses,
+    successen/fouten en bytes. Op het einde: samenvattende tabel in de feedback
+    en optioneel een JSON- of CSV-rapport.
+    """
+
+    FASES = ("lezen", "request", "parsen", "schrijven")
+
+    def __init__(self):
+        self.begin = time.monotonic()
+        self.fases = dict.fromkeys(self.FASES, 0.0)
+        self.tellers = Counter()
+        self.chunks = []
 
+    def nieuwe_chunk(self, **waarden):
+        rij = dict(chunk=len(self.chunks) + 1, **dict.fromkeys(self.FASES, 0.0), **waarden)
+        self.chunks.append(rij)
+        return rij
 
-def main(self, context, parameters, feedback=None):
-    load_module_from_github(feedback)
+    def voeg_toe(self, rij, fase, seconden):
+        self.fases[fase] += seconden
+        rij[fase] = rij.get(fase, 0.0) + seconden
+
+    @contextmanager
+    def fase(self, naam, rij):
+        begin = time.monotonic()
+        try:
+            yield
+        finally:
+            self.voeg_toe(rij, naam, time.monotonic() - begin)
+
+    def tel(self, rij=None, **aantallen):
+        self.tellers.update(aantallen)
+        if rij is not None:
+            for naam, aantal in aantallen.items():
+                rij[naam] = rij.get(naam, 0) + aantal
+
+    def seconden(self):
+        return time.monotonic() - self.begin
+
+    def samenvatting(self, feedback):
+        totaal = self.seconden()
+        aantal_chunks = max(1, len(self.chunks))
+        regels = [f"{'fase':<12}{'totaal (s)':>12}{'per chunk (ms)':>16}{'aandeel':>10}"]
+        for naam in self.FASES:
+            seconden = self.fases[naam]
+            aandeel = seconden / totaal if totaal > 0 else 0
+            regels.append(f"{naam:<12}{seconden:>12.2f}{1000 * seconden / aantal_chunks:>16.1f}{aandeel:>10.0%}")
+        regels.append(f"{'totaal':<12}{totaal:>12.2f}")
+        for naam, aantal in sorted(self.tellers.items()):
+            regels.append(f"{naam:<24}{aantal:>12}")
+        piek = piek_rss_mb()
+        if piek is not None:
+            regels.append(f"{'piek RSS (MB)':<24}{piek:>12.0f}")
+        feedback.pushInfo("run rapport:\n" + "\n".join(regels))
+
+    def schrijf_rapport(self, pad):
+        """Schrijf het rapport als JSON (samenvatting + chunks) of, bij .csv, één rij per chunk."""
+        if pad.lower().endswith(".csv"):
+            kolommen = []
+            for rij in self.chunks:
+                kolommen += [k for k in rij if k not in kolommen]
+            with open(pad, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=kolommen)
+                writer.writeheader()
+                writer.writerows(self.chunks)
+            return
+        with open(pad, "w", encoding="utf-8") as f:
+            json.dump({
+                "totaal_seconden": time.monotonic() - self.begin,
+                "fases": self.fases,
+                "tellers": dict(self.tellers),
+                "piek_rss_mb": piek_rss_mb(),
+                "chunks": self.chunks,
+            }, f, indent=2)
+
+
+def _sql_waarde(waarde):
+    # QGIS NULL (QVariant) -> None
+    if waarde is None or (hasattr(waarde, "isNull") and waarde.isNull()):
+        return None
+    return waarde
+
+
+def _groepeer_per_kolommen(changes):
+    """Groepeer {fid: {idx: waarde}} per set van gewijzigde kolommen (bv. met/zonder wegnummer)."""
+    groepen = {}
+    for fid, attrs in changes.items():
+        idxs = tuple(sorted(attrs))
+        groepen.setdefault(idxs, []).append((fid, *(_sql_waarde(attrs[i]) for i in idxs)))
+    return groepen
+
+
+def _quote(naam):
+    return '"' + naam.replace('"', '""') + '"'
+
+
+class SinkSchrijver:
+    """
+    Schrijft elke verwerkte chunk meteen als nieuwe features naar een QgsFeatureSink
+    (invoer + resultaatvelden), zonder edit buffer of wijziging aan de invoerlaag.
+    Zelfde interface als AttribuutSchrijver.
+    """
+
+    def __init__(self, sink, fields, feedback=None):
+        self.sink = sink
+        self.fields = fields
+        self.feedback = feedback
+        self.aantal_geschreven = 0
+        self.aantal_flushes = 0
+        self.seconden = 0.0
+
+    def voeg_toe(self, changes, na_commit=None, records=None):
+        begin = time.monotonic()
+        changes = als_wijzigingen_dict(changes)
+        features = []
+        for record in records or []:
+            feature = QgsFeature(self.fields)
+            feature.setGeometry(record.feature.geometry())
+            attributen = list(record.feature.attributes())
+            attributen += [None] * (self.fields.count() - len(attributen))
+            for idx, waarde in changes.get(record.fid, {}).items():
+                attributen[idx] = waarde
+            feature.setAttributes(attributen)
+            features.append(feature)
+        if not self.sink.addFeatures(features, QgsFeatureSink.FastInsert):
+            raise RuntimeError(f"addFeatures naar de uitvoerlaag mislukt ({len(features)} features)")
+        self.seconden += time.monotonic() - begin
+        self.aantal_geschreven += len(features)
+        self.aantal_flushes += 1
+        if na_commit is not None:
+            na_commit(set(changes))
+
+    def flush(self):
+        # features staan al in de sink; Processing finaliseert de sink na het algoritme
+        pass
+
+    def rapport(self):
+        snelheid = self.aantal_geschreven / self.seconden if self.seconden > 0 else 0
+        return f"uitvoerlaag: {self.aantal_geschreven} features geschreven ({snelheid:.0f} rijen/s)"
+
+
+def bulk_doel(layer):
+    """
+    Bepaal of de laag een bulk-update fast path ondersteunt.
+    Geeft ("gpkg", (pad, tabel, fid_kolom)), ("postgres", (uri, tabel, pk_kolom)) of None terug.
+    """
+    provider = layer.providerType()
+    if provider == "ogr":
+        delen = QgsProviderRegistry.instance().decodeUri("ogr", layer.source())
+        pad = delen.get("path", "")
+        if not pad.lower().endswith(".gpkg"):
+            return None
+        tabel = delen.get("layerName")
+        fid_kolom = "fid"
+        try:
+            from osgeo import ogr
+            ds = ogr.Open(pad)
+            if ds is not None:
+                # zonder layerName (of met enkel layerid=) bepaalt OGR welke tabel de laag is
+                ogr_layer = ds.GetLayerByName(tabel) if tabel else ds.GetLayer(int(delen.get("layerId") or 0))
+                if ogr_layer is not None:
+                    tabel = ogr_layer.GetName()
+                    fid_kolom = ogr_layer.GetFIDColumn() or fid_kolom
+        except ImportError:
+            pass
+        if not tabel:
+            # tabel niet zeker gekend (geen GDAL): geen fast path, gewone edit-buffer
+            return None
+        return "gpkg", (pad, tabel, fid_kolom)
+
+    if provider == "postgres":
+        uri = QgsDataSourceUri(layer.source())
+        pk_kolom = uri.keyColumn().strip('"')
+        pk_idxs = layer.dataProvider().pkAttributeIndexes()
+        # enkel bij één integer-sleutel is fid == waarde van de sleutel
+        if not pk_kolom or "," in pk_kolom or len(pk_idxs) != 1:
+            return None
+        if layer.fields().at(pk_idxs[0]).typeName().lower() not in (
+                "int2", "int4", "int8", "integer", "bigint", "serial", "bigserial"):
+            return None
+        return "postgres", (uri, f"{_quote(uri.schema() or 'public')}.{_quote(uri.table())}", pk_kolom)
+    return None
+
+
+def bulk_update_gpkg(pad, tabel, fid_kolom, kolomnamen, changes):
+    """Laad de wijzigingen in een tijdelijke tabel en pas ze toe met één set-based UPDATE per kolomgroep."""
+    conn = sqlite3.connect(pad)
+    try:
+        # De GPKG rtree-triggers verwijzen naar ST_*-functies van GDAL. Ze vuren enkel bij een
+        # gewijzigde geometrie/fid (nooit hier), maar SQLite moet ze wel kunnen compileren.
+        for functie in ("ST_IsEmpty", "ST_MinX", "ST_MaxX", "ST_MinY", "ST_MaxY"):
+            conn.create_function(functie, 1, lambda geom: None)
+        with conn:
+            for idxs, rijen in _groepeer_per_kolommen(changes).items():
+                kolommen = [_quote(kolomnamen[i]) for i in idxs]
+                tijdelijk = [f"c{i}" for i in range(len(idxs))]
+                conn.execute("DROP TABLE IF EXISTS temp.ls2_update")
+                conn.execute(f"CREATE TEMP TABLE ls2_update (fid INTEGER PRIMARY KEY, {', '.join(tijdelijk)})")
+                conn.executemany(
+                    f"INSERT INTO temp.ls2_update VALUES ({', '.join('?' * (len(idxs) + 1))})", rijen)
+                toewijzingen = ", ".join(
+                    f"{k} = (SELECT u.{t} FROM temp.ls2_update u WHERE u.fid = {_quote(tabel)}.{_quote(fid_kolom)})"
+                    for k, t in zip(kolommen, tijdelijk))
+                conn.execute(
+                    f"UPDATE {_quote(tabel)} SET {toewijzingen} "
+                    f"WHERE {_quote(fid_kolom)} IN (SELECT fid FROM temp.ls2_update)")
+            conn.execute("DROP TABLE IF EXISTS temp.ls2_update")
+    finally:
+        conn.close()
+
+
+def bulk_update_postgres(uri, tabel, pk_kolom, kolomnamen, changes):
+    """Zelfde als bulk_update_gpkg voor PostGIS: tijdelijke tabel + UPDATE … FROM (vereist psycopg2)."""
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    conn = psycopg2.connect(uri.connectionInfo(True))
+    try:
+        with conn, conn.cursor() as cur:
+            for idxs, rijen in _groepeer_per_kolommen(changes).items():
+                kolommen = [_quote(kolomnamen[i]) for i in idxs]
+                cur.execute("DROP TABLE IF EXISTS ls2_update")
+                # tijdelijke tabel met dezelfde kolomtypes als de doeltabel
+                cur.execute(
+                    f"CREATE TEMP TABLE ls2_update AS SELECT {_quote(pk_kolom)} AS ls2_fid, {', '.join(kolommen)} "
+                    f"FROM {tabel} WITH NO DATA")
+                execute_values(cur, "INSERT INTO ls2_update VALUES %s", rijen, page_size=10000)
+                toewijzingen = ", ".join(f"{k} = u.{k}" for k in kolommen)
+                cur.execute(
+                    f"UPDATE {tabel} AS t SET {toewijzingen} FROM ls2_update u "
+                    f"WHERE t.{_quote(pk_kolom)} = u.ls2_fid")
+            cur.execute("DROP TABLE IF EXISTS ls2_update")
+    finally:
+        conn.close()
+
+
+class AttribuutSchrijver:
+    """
+    Verzamelt attribuutwijzigingen over chunks heen en schrijft ze om de flush_aantal features
+    of flush_seconden seconden in één changeAttributeValues-call (één provider-transactie) weg.
+    Er wordt geen edit buffer gebruikt; updateFields() is enkel nodig na een schemawijziging
+    (zie add_locatie_fields). flush() moet ook bij annuleren opgeroepen worden.
+    Met snel=True wordt voor GeoPackage en PostGIS een set-based bulk-update gebruikt
+    (zie bulk_doel), met terugval op changeAttributeValues als dat niet lukt.
+    """
+
+    def __init__(self, layer, flush_aantal=5000, flush_seconden=30.0, feedback=None, snel=False):
+        self.layer = layer
+        self.bulk = bulk_doel(layer) if snel else None
+        if snel and self.bulk is None and feedback:
+            feedback.pushInfo(f"geen bulk-update mogelijk voor provider {layer.providerType()}, standaard schrijfpad")
+        self.flush_aantal = flush_aantal
+        self.flush_seconden = flush_seconden
+        self.feedback = feedback
+        self.buffers = []  # dicts of CompacteWijzigingen, pas bij flush samengevoegd tot de provider-map
+        self.aantal = 0
+        self.na_commit = []  # (callback, fids) uit te voeren na de volgende flush
+        self.laatste_flush = time.monotonic()
+        self.aantal_geschreven = 0
+        self.aantal_flushes = 0
+        self.seconden = 0.0
+
+    def voeg_toe(self, changes, na_commit=None, records=None):
+        if len(changes):
+            self.buffers.append(changes)
+            self.aantal += len(changes)
+        if na_commit is not None:
+            self.na_commit.append((na_commit, set(changes)))
+        if (self.aantal >= self.flush_aantal
+                or time.monotonic() - self.laatste_flush >= self.flush_seconden):
+            self.flush()
+
+    def flush(self):
+        if self.buffers:
+            begin = time.monotonic()
+            changes = {}
+            for buffer in self.buffers:
+                als_wijzigingen_dict(buffer, changes)
+            self.buffers = []
+            self.aantal = 0
+            if not self._bulk_flush(changes):
+                ok = self.layer.dataProvider().changeAttributeValues(changes)
+                if not ok:
+                    raise RuntimeError(f"changeAttributeValues mislukt voor {len(changes)} features")
+            self.seconden += time.monotonic() - begin
+            self.aantal_geschreven += len(changes)
+            self.aantal_flushes += 1
+            if self.feedback:
+                self.feedback.pushInfo(f"Wrote results to layer ({len(changes)} features bijgewerkt)")
+            self.layer.triggerRepaint()
+        self.laatste_flush = time.monotonic()
+
+        na_commit, self.na_commit = self.na_commit, []
+        for callback, fids in na_commit:
+            callback(fids)
+
+    def _bulk_flush(self, changes):
+        if self.bulk is None:
+            return False
+        soort, doel = self.bulk
+        kolomnamen = {i: self.layer.fields().at(i).name() for attrs in changes.values() for i in attrs}
+        try:
+            if soort == "gpkg":
+                bulk_update_gpkg(*doel, kolomnamen, changes)
+            else:
+                bulk_update_postgres(*doel, kolomnamen, changes)
+        except Exception as e:
+            if self.feedback:
+                self.feedback.reportError(
+                    f"bulk-update ({soort}) mislukt, terugval op changeAttributeValues: {e}", fatalError=False)
+            self.bulk = None
+            return False
+        # provider heeft de wijzigingen niet zelf geschreven: gecachte waarden verversen
+        self.layer.dataProvider().reloadData()
+        return True
+
+    def rapport(self):
+        snelheid = self.aantal_geschreven / self.seconden if self.seconden > 0 else 0
+        return (f"weggeschreven: {self.aantal_geschreven} features in {self.aantal_flushes} flushes "
+                f"({snelheid:.0f} rijen/s)")
+
+
+def _laad_modules(parameters, feedback, afspelen=False):
+    """Laad de modules (module cache) en geef (Locatieservices2, AuthenticatieProxyAcmAwv) terug; None bij afspelen."""
+    try:
+        load_module_from_github(
+            feedback,
+            ttl=parameters.get("module cache ttl", MODULE_CACHE_TTL),
+            offline=parameters.get("offline", False) or afspelen
+        )
+    except Exception as e:
+        if not afspelen:
+            raise
+        # F_TYPE is dan niet beschikbaar: de resultaatvelden moeten al in de laag staan
+        feedback.reportError(f"Modules niet geladen ({e}), afspelen gaat verder zonder", fatalError=False)
+    if afspelen:
+        return None, None
     import Locatieservices2 as Ls2
     import AuthenticatieProxyAcmAwv as auth
+    return Ls2, auth
+
+
+def maak_sessie(auth, cookie):
+    session = auth.prepareSession(cookie=cookie)
+    session = auth.proxieHandler(session)
+    meet_verkeer(session)
+    return session
+
+
+# {"verzonden": bytes, "ontvangen": bytes} van de chunk waarvoor de huidige worker-thread LS2 aanroept
+_VERKEER = globals().get("_VERKEER") or threading.local()
+
+
+def tel_verkeer(response, *args, **kwargs):
+    """requests response-hook: tel de bytes van request-body en response bij de chunk van deze thread."""
+    teller = getattr(_VERKEER, "teller", None)
+    if teller is None:
+        return
+    body = getattr(response.request, "body", None)
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    teller["verzonden"] += len(body) if isinstance(body, (bytes, bytearray)) else 0
+    teller["ontvangen"] += len(response.content or b"")
+
+
+def meet_verkeer(session):
+    """
+    Hang tel_verkeer aan de response-hooks van een requests-sessie (ook na importlib.reload maar één keer).
+    False als de sessie geen hooks kent: de bytes worden dan niet gemeten.
+    """
+    hooks = getattr(session, "hooks", None)
+    if not isinstance(hooks, dict):
+        return False
+    response_hooks = [hook for hook in hooks.get("response", [])
+                      if getattr(hook, "__qualname__", None) != "tel_verkeer"
+                      or getattr(hook, "__module__", None) != __name__]
+    hooks["response"] = response_hooks + [tel_verkeer]
+    return True
+
+
+# sessieregister: blijft bewaard bij importlib.reload (de tool herlaadt deze module bij een nieuwe versie),
+# zodat opeenvolgende runs in dezelfde QGIS-sessie dezelfde keep-alive verbindingen hergebruiken
+_SESSIES = globals().get("_SESSIES", {})  # (cookie-hash, proxies, OMGEVING) -> dict met sessie en metadata
+_SESSIES_LOCK = globals().get("_SESSIES_LOCK") or threading.Lock()
+
+
+def sessie_sleutel(cookie):
+    proxies = tuple(sorted(urllib.request.getproxies().items()))
+    return hashlib.sha256(str(cookie).encode("utf-8")).hexdigest(), proxies, OMGEVING
+
+
+def sessie_geldig(session):
+    """Goedkope controle zonder netwerk: geen verlopen cookies in de sessie."""
+    try:
+        return not any(cookie.is_expired() for cookie in getattr(session, "cookies", None) or [])
+    except Exception:
+        return False
+
+
+def is_auth_fout(e):
+    """True als de exception op een 401/403 wijst (requests, urllib of httpx/aiohttp-stijl)."""
+    response = getattr(e, "response", None)
+    status = getattr(response, "status_code", None) or getattr(e, "code", None) or getattr(e, "status", None)
+    return status in (401, 403)
+
+
+def stel_pool_in(session, pool_grootte):
+    """Vergroot de connection pool van de standaard requests-adapters tot pool_grootte (nooit verkleinen)."""
+    try:
+        from requests.adapters import HTTPAdapter
+    except ImportError:
+        return
+    adapters = getattr(session, "adapters", None) or {}
+    for prefix in ("https://", "http://"):
+        adapter = adapters.get(prefix)
+        # eigen adapters (bv. van proxieHandler) laten we ongemoeid
+        if type(adapter) is not HTTPAdapter or adapter._pool_maxsize >= pool_grootte:
+            continue
+        session.mount(prefix, HTTPAdapter(
+            pool_connections=adapter._pool_connections,
+            pool_maxsize=pool_grootte,
+            max_retries=adapter.max_retries,
+            pool_block=adapter._pool_block
+        ))
+        adapter.close()
+
+
+def pool_tellers(session):
+    """(aantal requests, aantal nieuw geopende verbindingen) over alle urllib3-pools van de sessie."""
+    requests_totaal = verbindingen = 0
+    for adapter in (getattr(session, "adapters", None) or {}).values():
+        pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+        if pools is None:
+            continue
+        for sleutel in pools.keys():
+            pool = pools.get(sleutel)
+            requests_totaal += getattr(pool, "num_requests", 0)
+            verbindingen += getattr(pool, "num_connections", 0)
+    return requests_totaal, verbindingen
+
+
+def geef_sessie(auth, cookie, pool_grootte=10, idle_timeout=SESSIE_IDLE_TIMEOUT, feedback=None):
+    """
+    Geef een herbruikbare sessie voor (cookie, proxy-instellingen, OMGEVING) uit het sessieregister.
+    Sessies die langer dan idle_timeout ongebruikt bleven of verlopen cookies hebben worden opnieuw opgebouwd.
+    """
+    sleutel = sessie_sleutel(cookie)
+    with _SESSIES_LOCK:
+        nu = time.monotonic()
+        for andere in [k for k, item in _SESSIES.items() if nu - item["laatst_gebruikt"] > idle_timeout]:
+            _sluit_sessie(_SESSIES.pop(andere)["session"])
+
+        item = _SESSIES.get(sleutel)
+        if item is not None and sessie_geldig(item["session"]):
+            hergebruikt = True
+        else:
+            if item is not None:
+                _sluit_sessie(item["session"])
+            item = {"auth": auth, "cookie": cookie, "session": maak_sessie(auth, cookie), "vorige": None}
+            _SESSIES[sleutel] = item
+            hergebruikt = False
+        item["laatst_gebruikt"] = nu
+        item["pool_grootte"] = max(pool_grootte, item.get("pool_grootte", 0))
+        stel_pool_in(item["session"], item["pool_grootte"])
+    if feedback:
+        feedback.pushInfo(f"sessie: {'hergebruikt uit het sessieregister' if hergebruikt else 'nieuw opgebouwd'} "
+                          f"(pool {item['pool_grootte']}, {len(_SESSIES)} sessies in register)")
+    return item["session"]
+
+
+def vernieuw_sessie(oude_sessie):
+    """
+    Bouw de sessie opnieuw op na een authenticatiefout. Geeft de nieuwe sessie terug, of None als
+    oude_sessie niet uit het register komt. Meerdere threads die tegelijk falen krijgen dezelfde nieuwe sessie.
+    """
+    if oude_sessie is None:
+        return None
+    with _SESSIES_LOCK:
+        for item in _SESSIES.values():
+            if item["vorige"] is oude_sessie:
+                return item["session"]
+            if item["session"] is oude_sessie:
+                # oude sessie niet sluiten: andere threads kunnen er nog een request mee onderweg hebben
+                item["session"] = maak_sessie(item["auth"], item["cookie"])
+                item["vorige"] = oude_sessie
+                stel_pool_in(item["session"], item["pool_grootte"])
+                return item["session"]
+    return None
+
+
+def _sluit_sessie(session):
+    try:
+        session.close()
+    except Exception:
+        pass
+
+
+def pool_grootte(parameters):
+    """'connection pool grootte'; 0 = gelijk aan het aantal parallelle requests."""
+    return int(parameters.get("connection pool grootte", 0) or 0) or max(1, int(parameters.get("parallelle requests", 1)))
+
+
+def main(self, context, parameters, feedback=None, layer=None, gedeeld=None):
+    """
+    Verwerk één laag. layer: rechtstreeks op te geven laag (batch), anders parameter INPUT.
+    gedeeld: GedeeldeRun uit batch_main; modules, sessie en resultaat cache
+    worden dan hergebruikt en niet gesloten.
+    """
+    # opname: LS2-verkeer opnemen of afspelen (afspelen: geen netwerk en geen authenticatie)
+    opname_modus = OPNAME_MODI[int(parameters.get("opname modus", 0) or 0)]
+    opname = None
+    if opname_modus != "uit":
+        if not parameters.get("opname bestand"):
+            raise Exception(f"Opname modus '{opname_modus}' vereist een opname bestand.")
+        opname = Ls2Opname(parameters["opname bestand"])
+    afspelen = opname_modus == "afspelen"
+
+    if gedeeld is not None and not afspelen:
+        # batch: modules zijn één keer geladen
+        Ls2, auth = gedeeld.Ls2, gedeeld.auth
+    else:
+        Ls2, auth = _laad_modules(parameters, feedback, afspelen)
+    if afspelen:
+        opname.laad()
+        feedback.pushInfo(f"opname geladen: {len(opname.per_hash)} requests uit {opname.pad}")
 
     # ✅ Reconstrueer de laag op robuuste wijze (FeatureSourceDefinition of dynamische property)
-    layer = self.parameterAsVectorLayer(parameters, 'INPUT', context)
+    if layer is None:
+        layer = self.parameterAsVectorLayer(parameters, 'INPUT', context)
     if layer is None:
         # Probeer via evaluatie naar string (deze evalueert een QgsProperty)
         src_str = self.parameterAsString(parameters, 'INPUT', context)
@@ -562,13 +2020,21 @@ def main(self, context, parameters, feedback=None):
     crs_id = src_crs.authid()
     feedback.pushInfo(f"CRS: {crs_id}")
 
+    # geom_type is de wkbType van de laag; lijn of punt wordt bepaald met is_lijn (geometryType),
+    # zodat ook CompoundCurve/CircularString/MultiCurve als lijn behandeld worden
     wkb_type = layer.wkbType()
-    geom_type = QgsWkbTypes.displayString(wkb_type)
-    feedback.pushInfo(f"Geometry type: {geom_type}")
+    geom_type = wkb_type
+    feedback.pushInfo(f"Geometry type: {QgsWkbTypes.displayString(wkb_type)}")
 
     # maak sessie
-    session = auth.prepareSession(cookie=parameters["cookie"])
-    session = auth.proxieHandler(session)
+    session = None
+    if gedeeld is not None:
+        session = gedeeld.session
+    elif not afspelen:
+        session = geef_sessie(auth, parameters["cookie"], pool_grootte(parameters),
+                              parameters.get("sessie idle timeout", SESSIE_IDLE_TIMEOUT), feedback)
+    pool_voor = pool_tellers(session)
+    verkeer_gemeten = meet_verkeer(session)
 
     # voorbereiding data lezen
     req = QgsFeatureRequest()
@@ -580,51 +2046,506 @@ def main(self, context, parameters, feedback=None):
     else:
         f_subset = []
 
-    # voeg velden relatieve weglocatie toe volgens F_TYPE in Locatieservices2.py
-    f_wegnummer = add_locatie_fields(layer, geom_type, f_wegnummer, feedback)
+    # sink-modus: resultaten naar een nieuwe uitvoerlaag, de invoerlaag blijft read-only
+    sink, dest_id = None, None
+    if self.parameterDefinition("OUTPUT") is not None:
+        uitvoer_fields = QgsFields(layer.fields())
+        f_wegnummer_uitvoer, new_fields = maak_locatie_fields(uitvoer_fields, geom_type, f_wegnummer, feedback)
+        for fld in new_fields:
+            uitvoer_fields.append(fld)
+        sink, dest_id = self.parameterAsSink(parameters, "OUTPUT", context, uitvoer_fields, wkb_type, src_crs)
+
+    if sink is not None:
+        feedback.pushInfo(f"resultaten worden naar de uitvoerlaag geschreven: {dest_id}")
+        f_wegnummer = f_wegnummer_uitvoer
+        fields = uitvoer_fields
+    else:
+        # voeg velden relatieve weglocatie toe volgens F_TYPE in Locatieservices2.py
+        f_wegnummer = add_locatie_fields(layer, geom_type, f_wegnummer, feedback)
+        fields = layer.fields()
 
     print(f"f_wegnummer (NA add_locatie_fields):{str(f_wegnummer)}")
 
+    # mislukte punten: histogram per klasse, beperkt aantal voorbeelden, optioneel een puntenlaag
+    fouten_sink, fouten_id = None, None
+    if self.parameterDefinition("FAILED") is not None and parameters.get("FAILED"):
+        # optionele uitvoer (createByDefault=False): niet gevraagd = geen waarde, dan ook geen velden bouwen
+        fouten_sink, fouten_id = self.parameterAsSink(
+            parameters, "FAILED", context, FoutVerzamelaar.velden(), QgsWkbTypes.Point, src_crs)
+    fouten = FoutVerzamelaar(
+        feedback, max_voorbeelden=int(parameters.get("max foutvoorbeelden per klasse", 5)), sink=fouten_sink)
+
+    # in sink-modus kan het wegnummerveld in de invoerlaag ontbreken (-1)
     idx_wegnummer = layer.fields().indexFromName(f_wegnummer)
 
-    # verzamel oid
-    if layer.selectedFeatureCount() > 0:
-        fid_list = layer.selectedFeatureIds()  # geselecteerde FIDs
+    # groeperen per wegnummer: chunks liggen dan op dezelfde weg (lokaliteit bij LS2);
+    # de volgorde hangt dan af van de wegnummers (die we net invullen), dus geen checkpoint
+    groeperen = bool(parameters.get("groepeer per wegnummer", False))
+    if groeperen and idx_wegnummer == -1:
+        feedback.pushInfo("groeperen per wegnummer niet mogelijk: wegnummerveld ontbreekt in de invoerlaag")
+        groeperen = False
+    checkpoint_actief = sink is None and not groeperen
+
+    # fids lui ophalen; een checkpoint is het aantal reeds gecommitte fids in die volgorde
+    selectie = layer.selectedFeatureIds() if layer.selectedFeatureCount() > 0 else None
+    totaal = len(selectie) if selectie is not None else layer.featureCount()
+    sleutel = checkpoint_sleutel(layer, selectie) if checkpoint_actief else None
+    overslaan = 0
+    if parameters.get("hervat vanaf checkpoint", False) and checkpoint_actief:
+        overslaan = lees_checkpoint(layer, sleutel)
+        if overslaan:
+            feedback.pushInfo(f"hervat na checkpoint: {overslaan} features reeds verwerkt")
+    if groeperen:
+        fid_stroom = FidStroom(layer, fids=fids_per_wegnummer(layer, idx_wegnummer, selectie), sorteer=False)
+    elif selectie is not None:
+        fid_stroom = FidStroom(layer, overslaan=overslaan, fids=selectie)  # geselecteerde FIDs
     else:
-        fid_list = [f.id() for f in layer.getFeatures()]  # Geen selectie → neem alle FIDs van de laag
-
-    start = 0
-    limit = parameters["aantal elementen per request"]
-
-    while start < len(fid_list):
-        fid_selectie = fid_list[start:start + limit]
-        feedback.pushInfo(
-            f'behandel volgende records: van fid {fid_selectie[0]} tot {fid_selectie[-1]}: {len(fid_selectie)} features')
-        req = QgsFeatureRequest().setFilterFids(fid_selectie)
-
-        locaties = maak_json_locatie(feedback, layer, req, crs_id, f_subset, idx_wegnummer, geom_type)
-        feedback.pushInfo(f"aantal locaties in locaties:{str(len(locaties))}")
-
-        responses = Ls2.request_ls2_puntlocatie(
-            locaties=locaties,
-            omgeving=OMGEVING,
-            zoekafstand=parameters["zoekafstand"],
-            crs=crs_id,
-            session=session,
-            gebruik_kant_van_de_weg=parameters["gebruik kant van de weg"]
+        fid_stroom = FidStroom(layer, overslaan=overslaan)  # Geen selectie → alle FIDs van de laag
+
+    # 'aantal elementen per request' is de bovengrens; 0 (oude default) => 1000
+    limit = parameters["aantal elementen per request"] or 1000
+    batch = AdaptieveBatchGrootte(maximum=limit) if parameters.get("adaptieve chunkgrootte", True) else None
+    pogingen = max(1, int(parameters.get("aantal pogingen", 3)))
+    # aantal chunks waarvan het LS2-request tegelijk onderweg mag zijn
+    parallel = max(1, int(parameters.get("parallelle requests", 1)))
+    feedback.pushInfo(f"parallelle requests: {parallel}")
+
+    request_kwargs = dict(
+        omgeving=OMGEVING,
+        zoekafstand=parameters["zoekafstand"],
+        crs=crs_id,
+        session=session,
+        gebruik_kant_van_de_weg=parameters["gebruik kant van de weg"]
+    )
+
+    # zoekbeperkingen: gekend wegnummer meesturen en het wegtype-filter doorgeven
+    stuur_wegnummer = parameters.get("stuur wegnummer mee", True)
+    wegtype = WEGTYPES[int(parameters.get("wegtype", 0) or 0)]
+    if wegtype is not None and Ls2 is not None:
+        if _aanvaardt_argument(Ls2.request_ls2_puntlocatie, "wegtype"):
+            request_kwargs["wegtype"] = wegtype
+        else:
+            feedback.reportError(
+                "Locatieservices2.request_ls2_puntlocatie kent geen 'wegtype': filter niet toegepast", fatalError=False)
+            wegtype = None
+
+    # ontdubbelen van eindpunten die door meerdere features gedeeld worden
+    ontdubbel = parameters.get("ontdubbel eindpunten", True)
+    # snaptolerantie in meter, omgezet naar kaarteenheden (graden in een geografisch CRS)
+    tolerantie = tolerantie_in_kaarteenheden(float(parameters.get("snaptolerantie", 0.001) or 0.0), src_crs)
+    if ontdubbel and tolerantie > 0:
+        feedback.pushInfo(f"snaptolerantie ontdubbeling: {tolerantie:g} kaarteenheden")
+
+    # metingen per fase en per chunk; optioneel rapport als JSON/CSV
+    statistieken = RunStatistieken()
+    rapport_pad = None
+    if self.parameterDefinition("rapport") is not None:
+        rapport_pad = self.parameterAsFileOutput(parameters, "rapport", context)
+
+    # persistente resultaat cache; bij 'negeer resultaat cache' wordt alles opnieuw gevraagd (en de cache ververst)
+    # bij afspelen komen alle antwoorden uit de opname
+    # bij opnemen ook: anders komen enkel de cache-missers in de opname en mist het afspelen de rest
+    negeer_cache = parameters.get("negeer resultaat cache", False) or opname is not None
+    if gedeeld is not None:
+        resultaat_cache = gedeeld.resultaat_cache
+    else:
+        resultaat_cache = Ls2ResultaatCache(
+            max_aantal=parameters.get("resultaat cache max aantal", 1000000),
+            max_leeftijd_dagen=parameters.get("resultaat cache max leeftijd (dagen)", 30)
+        )
+    cache_hits, cache_misses = resultaat_cache.hits, resultaat_cache.misses
+
+    # incrementeel: features met ongewijzigde eindpunten en reeds gevulde resultaatvelden overslaan
+    incrementeel = None
+    idx_resultaat = [layer.fields().indexFromName(naam) for naam in resultaat_velden(geom_type)]
+    if parameters.get("incrementeel", False) and sink is not None:
+        # sink-modus: de resultaatvelden staan niet in de invoerlaag en een overgeslagen feature
+        # zou in de uitvoerlaag ontbreken, dus hier niets overslaan
+        feedback.reportError(
+            "incrementeel wordt niet ondersteund met een uitvoerlaag: alle features worden verwerkt", fatalError=False)
+    elif parameters.get("incrementeel", False):
+        incrementeel = IncrementeleStatus(
+            laag_sleutel=layer.source(),
+            parameters_sleutel=(f"{OMGEVING}|{request_kwargs['zoekafstand']}|{request_kwargs['gebruik_kant_van_de_weg']}"
+                                + (f"|{wegtype}" if wegtype is not None else "")
+                                + ("" if stuur_wegnummer else "|zonder wegnummer"))
         )
 
-        req_schrijf = QgsFeatureRequest()
-        req_schrijf.setFilterFids(fid_selectie)
-        f_subset = [f_wegnummer, "refpunt_wegnr", "refpunt_opschrift", "refpunt_afstand"]
+    # lokale referentie-engine: eerst lokaal bepalen, LS2 enkel voor wat lokaal niet lukt
+    lokaal = None
+    lokaal_pad = parameters.get("lokale referentie gpkg")
+    if lokaal_pad and opname is not None:
+        # opname en afspelen bevatten alle locaties met het LS2-antwoord, niet de lokale bepaling
+        feedback.pushInfo("lokale referentie uitgeschakeld tijdens opnemen/afspelen")
+        lokaal_pad = None
+    if lokaal_pad and gebruikt_kant_van_de_weg(request_kwargs["gebruik_kant_van_de_weg"]):
+        # de lokale engine kent geen kant van de weg: alles naar LS2
+        feedback.pushInfo("lokale referentie uitgeschakeld: 'gebruik kant van de weg' staat aan")
+        lokaal_pad = None
+    if lokaal_pad:
+        import Ls2LokaleReferentie
+        if not os.path.exists(lokaal_pad):
+            referentiepunten = self.parameterAsVectorLayer(parameters, "referentiepunten (import)", context)
+            wegen = self.parameterAsVectorLayer(parameters, "wegassen (import)", context)
+            if referentiepunten is None or wegen is None:
+                raise Exception(f"{lokaal_pad} bestaat niet: geef referentiepunten en wegassen op om te importeren.")
+            Ls2LokaleReferentie.importeer_referentiedata(
+                referentiepunten, wegen, lokaal_pad,
+                veld_wegnummer_ref=parameters.get("veld wegnummer referentiepunten") or "wegnummer",
+                veld_opschrift=parameters.get("veld opschrift referentiepunten") or "opschrift",
+                veld_wegnummer_weg=parameters.get("veld wegnummer wegassen") or "wegnummer",
+                feedback=feedback
+            )
+        idx_afstand = fields.indexFromName(resultaat_velden(geom_type)[2])
+        lokaal = Ls2LokaleReferentie.LokaleReferentie(
+            lokaal_pad, zoekafstand=request_kwargs["zoekafstand"], crs_id=crs_id, feedback=feedback,
+            afstand_decimalen=afstand_decimalen(fields.at(idx_afstand)) if idx_afstand != -1 else None)
+
+    def vraag_chunk(compact):
+        # draait in een worker-thread. Locatieservices2.request_ls2_puntlocatie neemt een lijst van
+        # dicts en bouwt zelf de body, dus streamen uit de kolommen kan hier niet: pas aan deze
+        # transportgrens worden de dicts opgebouwd. Het CRS-blok is één gedeeld object in geheugen,
+        # maar staat in de body nog per punt.
+        locaties = compact.als_json()
+        if afspelen:
+            begin = time.monotonic()
+            responses, gesplitst = opname.speel_af(locaties), False
+            return responses, time.monotonic() - begin, gesplitst, None, None
+        # bytes via de response-hook van de sessie (tel_verkeer), ook van retries en splitsingen
+        teller = _VERKEER.teller = {"verzonden": 0, "ontvangen": 0}
+        try:
+            responses, seconden, gesplitst = request_met_splitsing(Ls2, locaties, request_kwargs, pogingen=pogingen)
+        finally:
+            _VERKEER.teller = None
+        if not verkeer_gemeten:
+            return responses, seconden, gesplitst, None, None
+        return responses, seconden, gesplitst, teller["verzonden"], teller["ontvangen"]
+
+    def cache_sleutel(locaties, i):
+        x, y = locaties.coordinaten(i)
+        return Ls2ResultaatCache.sleutel_xy(
+            x, y, locaties.wegnummer(i), crs_id, request_kwargs["zoekafstand"],
+            request_kwargs["gebruik_kant_van_de_weg"], wegtype=wegtype)
+
+    def bereid_chunk_voor(locaties, records):
+        if ontdubbel:
+            unieke_locaties, verwijzingen = ontdubbel_locaties(locaties, crs_id, tolerantie)
+        else:
+            unieke_locaties, verwijzingen = locaties, range(len(locaties))
+        chunk = Chunk(records, locaties, unieke_locaties, verwijzingen)
+
+        if not negeer_cache:
+            # sleutels niet bijhouden: bij het bewaren worden ze enkel voor de nieuwe antwoorden herberekend
+            sleutels = [cache_sleutel(unieke_locaties, i) for i in range(len(unieke_locaties))]
+            gevonden = resultaat_cache.haal_op(sleutels)
+            chunk.uit_cache = {i: gevonden[s] for i, s in enumerate(sleutels) if s in gevonden}
+            chunk.te_vragen = array("i", (i for i in range(len(unieke_locaties)) if i not in chunk.uit_cache))
+        if lokaal is not None:
+            # eerst lokaal proberen, enkel wat lokaal niet eenduidig is gaat naar LS2
+            for i in chunk.te_vragen:
+                x, y = unieke_locaties.coordinaten(i)
+                waarden = lokaal.bepaal(x, y, unieke_locaties.wegnummer(i))
+                if waarden is not None:
+                    chunk.lokaal[i] = Ls2LokaleReferentie.als_response(waarden)
+            chunk.te_vragen = array("i", (i for i in chunk.te_vragen if i not in chunk.lokaal))
+        return chunk
+
+    def schrijf_chunk(chunk):
+        # Wegschrijven gebeurt altijd op de hoofdthread en in fid-volgorde
+        nieuwe_responses, seconden, gesplitst, verzonden, ontvangen = chunk.future.result()
+        nieuwe_responses = nieuwe_responses or []
+        statistieken.voeg_toe(chunk.rij, "request", seconden)
+        if opname is not None and not afspelen and chunk.te_vragen:
+            opname.neem_op(chunk.rij["chunk"], chunk.unieke_locaties.als_json(chunk.te_vragen), nieuwe_responses)
+        if batch is not None and chunk.te_vragen:
+            vorige = batch.grootte
+            batch.registreer(len(chunk.records), len(chunk.te_vragen), seconden, gesplitst)
+            if batch.grootte != vorige:
+                feedback.pushInfo(
+                    f"chunkgrootte {vorige} -> {batch.grootte} features "
+                    f"({seconden:.1f} s voor {len(chunk.te_vragen)} locaties{', gesplitst na fout' if gesplitst else ''})")
+        unieke_responses = [None] * len(chunk.unieke_locaties)
+        for i, response in chunk.uit_cache.items():
+            unieke_responses[i] = response
+        for i, response in chunk.lokaal.items():
+            unieke_responses[i] = response
+        for i, response in zip(chunk.te_vragen, nieuwe_responses):
+            unieke_responses[i] = response
+
+        # enkel bruikbare antwoorden bewaren, fouten worden de volgende run opnieuw gevraagd
+        geldig = [
+            (cache_sleutel(chunk.unieke_locaties, i), response)
+            for i, response in zip(chunk.te_vragen, nieuwe_responses)
+            if response and _extract_refpunt_values(response) is not None
+        ]
+        resultaat_cache.bewaar(geldig)
+        statistieken.tel(
+            chunk.rij,
+            responses=sum(1 for response in nieuwe_responses if response is not None),
+            successen=len(geldig),
+            fouten=len(chunk.te_vragen) - len(geldig)
+        )
+        if verzonden is not None:
+            statistieken.tel(chunk.rij, bytes_verzonden=verzonden, bytes_ontvangen=ontvangen)
+
+        def na_commit(geschreven):
+            if incrementeel is not None:
+                incrementeel.bewaar(record for record in chunk.records if record.fid in geschreven)
+            # chunk is gecommit: een herstarte run kan vanaf hier verder (enkel bij bijwerken van de invoerlaag)
+            if checkpoint_actief:
+                schrijf_checkpoint(layer, sleutel, chunk.verwerkt)
+
+        schrijven_voor = schrijver.seconden
+        begin = time.monotonic()
         schrijf_resultaten_naar_layer(
             layer=layer,
-            req=req_schrijf,
+            records=chunk.records,
             geom_type=geom_type,
             f_wegnummer=f_wegnummer,
-            responses=responses,
-            feedback=feedback
+            responses=verdeel_responses(unieke_responses, chunk.verwijzingen),
+            feedback=feedback,
+            indices=chunk.locaties.indices(),
+            schrijver=schrijver,
+            na_commit=na_commit,
+            fields=fields,
+            fouten=fouten
         )
+        # flushes van de schrijver tellen als 'schrijven', de rest (koppelen + parsen) als 'parsen'
+        schrijven = schrijver.seconden - schrijven_voor
+        statistieken.voeg_toe(chunk.rij, "parsen", time.monotonic() - begin - schrijven)
+        statistieken.voeg_toe(chunk.rij, "schrijven", schrijven)
 
-        start += limit
+    if sink is not None:
+        schrijver = SinkSchrijver(sink, fields, feedback=feedback)
+    else:
+        schrijver = AttribuutSchrijver(
+            layer,
+            flush_aantal=parameters.get("schrijf interval (features)", 5000),
+            flush_seconden=parameters.get("schrijf interval (seconden)", 30),
+            feedback=feedback,
+            snel=parameters.get("snelle bulk-update", False)
+        )
 
+    in_behandeling = deque()  # chunks in volgorde van indienen
+    try:
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            while not feedback.isCanceled():
+                grootte = batch.grootte if batch is not None else limit
+                fid_selectie = fid_stroom.volgende(grootte)
+                if not fid_selectie:
+                    break
+                feedback.pushInfo(
+                    f'behandel volgende records: van fid {fid_selectie[0]} tot {fid_selectie[-1]}: {len(fid_selectie)} features')
+                req = QgsFeatureRequest().setFilterFids(fid_selectie)
+                if incrementeel is not None:
+                    incrementeel.laad(fid_selectie)
+                if sink is not None:
+                    pass  # volledige features nodig voor de kopie naar de uitvoerlaag
+                elif incrementeel is not None:
+                    # resultaatvelden mee lezen om te weten of een feature al ingevuld is
+                    req.setSubsetOfAttributes([idx_wegnummer] + idx_resultaat)
+                else:
+                    req.setSubsetOfAttributes([idx_wegnummer])  # enkel het wegnummer, de rest wordt niet gelezen
+
+                # Lezen van de laag blijft op de hoofdthread, enkel de HTTP-call gaat naar de pool
+                rij = statistieken.nieuwe_chunk(eerste_fid=fid_selectie[0], laatste_fid=fid_selectie[-1])
+                with statistieken.fase("lezen", rij):
+                    locaties, records = maak_json_locatie(
+                        feedback, layer, req, crs_id, f_subset, idx_wegnummer, geom_type,
+                        idx_resultaat=idx_resultaat,
+                        ongewijzigd=incrementeel.ongewijzigd if incrementeel is not None else None,
+                        alle_features=sink is not None,
+                        stuur_wegnummer=stuur_wegnummer
+                    )
+                    chunk = bereid_chunk_voor(locaties, records)
+                chunk.fids = fid_selectie
+                chunk.verwerkt = fid_stroom.geleverd
+                chunk.rij = rij
+                statistieken.tel(
+                    rij,
+                    features=sum(1 for record in records if record.punten),
+                    punten=len(chunk.locaties),
+                    uniek=len(chunk.unieke_locaties),
+                    uit_cache=len(chunk.uit_cache),
+                    lokaal=len(chunk.lokaal),
+                    verstuurd=len(chunk.te_vragen)
+                )
+                feedback.pushInfo(
+                    f"aantal locaties in locaties:{str(len(locaties))} "
+                    f"(uniek: {len(chunk.unieke_locaties)}, uit cache: {len(chunk.uit_cache)}, lokaal: {len(chunk.lokaal)})")
+
+                if chunk.te_vragen:
+                    te_vragen = chunk.unieke_locaties.selectie(chunk.te_vragen)
+                    chunk.future = pool.submit(vraag_chunk, te_vragen)
+                else:
+                    # alles uit de cache: geen request nodig
+                    chunk.future = Future()
+                    chunk.future.set_result(([], 0.0, False, 0, 0))
+                in_behandeling.append(chunk)
+
+                # Eén chunk meer dan het aantal workers klaarzetten, zodat de payload van
+                # chunk N+1 al opgebouwd is terwijl chunk N nog onderweg is
+                while len(in_behandeling) > parallel:
+                    schrijf_chunk(in_behandeling.popleft())
+
+                if totaal > 0:
+                    feedback.setProgress(100 * min(fid_stroom.geleverd, totaal) / totaal)
+
+            # Resterende chunks afwerken (ook bij annuleren: reeds verstuurde requests niet verloren laten gaan)
+            while in_behandeling:
+                schrijf_chunk(in_behandeling.popleft())
+
+        # ook bij annuleren: alle reeds verwerkte chunks wegschrijven
+        schrijven_voor = schrijver.seconden
+        schrijver.flush()
+        if statistieken.chunks:
+            # laatste flush rekenen we aan de laatste chunk toe
+            statistieken.voeg_toe(statistieken.chunks[-1], "schrijven", schrijver.seconden - schrijven_voor)
+        if not feedback.isCanceled() and checkpoint_actief:
+            # volledige run: volgende run begint opnieuw vooraan
+            verwijder_checkpoint(layer)
+
+        if gedeeld is None:
+            resultaat_cache.ruim_op()
+    finally:
+        # bij een fout: wat al verwerkt is niet verloren laten gaan
+        try:
+            schrijver.flush()
+            fouten.flush()
+        finally:
+            if gedeeld is None:
+                # gedeelde cache sluit batch_main na de laatste laag
+                resultaat_cache.sluit()
+            if incrementeel is not None:
+                incrementeel.sluit()
+
+    tellers = statistieken.tellers
+    if incrementeel is not None:
+        statistieken.tel(overgeslagen=incrementeel.overgeslagen)
+        feedback.pushInfo(
+            f"incrementeel: {incrementeel.overgeslagen} features ongewijzigd overgeslagen, {tellers['features']} verwerkt")
+
+    if tellers["punten"]:
+        feedback.pushInfo(
+            f"ontdubbeling: {tellers['punten']} locaties -> {tellers['uniek']} uniek "
+            f"(ratio {tellers['uniek'] / tellers['punten']:.2f})")
+        feedback.pushInfo(
+            f"ontdubbeling + cache: {tellers['punten']} locaties -> {tellers['verstuurd']} verstuurd "
+            f"(ratio {tellers['verstuurd'] / tellers['punten']:.2f}, "
+            f"{tellers['punten'] - tellers['verstuurd']} requests bespaard)")
+    if session is not None:
+        aantal_requests, verbindingen = (na - voor for na, voor in zip(pool_tellers(session), pool_voor))
+        if aantal_requests:
+            feedback.pushInfo(f"verbindingen: {aantal_requests} HTTP-requests over {verbindingen} nieuwe verbindingen "
+                              f"({aantal_requests - verbindingen} keer een bestaande verbinding hergebruikt)")
+    feedback.pushInfo(f"resultaat cache: {resultaat_cache.hits - cache_hits} hits, "
+                      f"{resultaat_cache.misses - cache_misses} misses")
+    if lokaal is not None:
+        feedback.pushInfo(f"lokale referentie: {lokaal.opgelost} lokaal bepaald, {lokaal.niet_opgelost} naar LS2")
+    if opname is not None:
+        if afspelen:
+            feedback.pushInfo(f"opname afgespeeld: {opname.afgespeeld} requests, {opname.missers} locaties niet in de opname")
+        else:
+            feedback.pushInfo(f"opname: {opname.opgenomen} requests toegevoegd aan {opname.pad}")
+    feedback.pushInfo(schrijver.rapport())
+    fouten.samenvatting()
+
+    statistieken.samenvatting(feedback)
+    if gedeeld is not None:
+        gedeeld.runs.append((layer.name(), dict(statistieken.tellers), statistieken.seconden()))
+    if rapport_pad:
+        statistieken.schrijf_rapport(rapport_pad)
+        feedback.pushInfo(f"rapport geschreven naar {rapport_pad}")
+
+    resultaten = {}
+    if sink is not None:
+        resultaten["OUTPUT"] = dest_id
+    if fouten_sink is not None:
+        resultaten["FAILED"] = fouten_id
+    return resultaten
+
+
+class GedeeldeRun:
+    """Wat batch_main over alle lagen deelt: modules, sessie (connection pool), en resultaat cache."""
+
+    def __init__(self, Ls2, auth, session, resultaat_cache):
+        self.Ls2 = Ls2
+        self.auth = auth
+        self.session = session
+        self.resultaat_cache = resultaat_cache
+        self.runs = []  # (laagnaam, tellers, seconden) per verwerkte laag
+
+    def sluit(self):
+        self.resultaat_cache.sluit()
+
+
+def lagen_uit_map(map_pad, feedback=None):
+    """Alle punt- en lijnlagen uit de GeoPackages in map_pad (niet recursief), gesorteerd op bestandsnaam."""
+    punt_en_lijn = (PUNT_GEOMETRIE, LIJN_GEOMETRIE)
+    ogr = QgsProviderRegistry.instance().providerMetadata("ogr")
+    lagen = []
+    for naam in sorted(os.listdir(map_pad)):
+        if not naam.lower().endswith(".gpkg"):
+            continue
+        for sublaag in ogr.querySublayers(os.path.join(map_pad, naam)):
+            if QgsWkbTypes.geometryType(sublaag.wkbType()) not in punt_en_lijn:
+                continue
+            laag = QgsVectorLayer(sublaag.uri(), f"{naam}|{sublaag.name()}", "ogr")
+            if laag.isValid():
+                lagen.append(laag)
+            elif feedback:
+                feedback.reportError(f"laag {sublaag.uri()} kon niet geopend worden", fatalError=False)
+    return lagen
+
+
+def batch_main(self, context, parameters, feedback=None):
+    """
+    Verwerk meerdere lagen (parameter INPUTS en/of alle GeoPackages in 'map met GeoPackages')
+    met één module-load, één sessie en één resultaat cache; per laag dezelfde pipeline als main.
+    """
+    lagen = []
+    for laag in self.parameterAsLayerList(parameters, "INPUTS", context) or []:
+        if isinstance(laag, QgsVectorLayer) and QgsWkbTypes.geometryType(laag.wkbType()) in (PUNT_GEOMETRIE, LIJN_GEOMETRIE):
+            lagen.append(laag)
+        else:
+            feedback.reportError(f"laag {laag.name()} overgeslagen: geen punt- of lijnlaag", fatalError=False)
+    if parameters.get("map met GeoPackages"):
+        lagen += lagen_uit_map(parameters["map met GeoPackages"], feedback)
+    if not lagen:
+        raise Exception("Geen invoerlagen: geef lagen op of een map met GeoPackages.")
+    feedback.pushInfo(f"batch: {len(lagen)} lagen")
+
+    Ls2, auth = _laad_modules(parameters, feedback)
+    gedeeld = GedeeldeRun(
+        Ls2, auth,
+        geef_sessie(auth, parameters["cookie"], pool_grootte(parameters),
+                    parameters.get("sessie idle timeout", SESSIE_IDLE_TIMEOUT), feedback),
+        Ls2ResultaatCache(
+            max_aantal=parameters.get("resultaat cache max aantal", 1000000),
+            max_leeftijd_dagen=parameters.get("resultaat cache max leeftijd (dagen)", 30)
+        )
+    )
+    begin = time.monotonic()
+    try:
+        for nummer, laag in enumerate(lagen, start=1):
+            if feedback.isCanceled():
+                break
+            feedback.pushInfo(f"=== laag {nummer}/{len(lagen)}: {laag.name()} ===")
+            main(self, context, parameters, feedback, layer=laag, gedeeld=gedeeld)
+        gedeeld.resultaat_cache.ruim_op()
+    finally:
+        gedeeld.sluit()
+
+    totaal_seconden = time.monotonic() - begin
+    regels = [f"{'laag':<40}{'features':>10}{'verstuurd':>11}{'seconden':>10}{'features/s':>12}"]
+    totaal_features = totaal_verstuurd = 0
+    for naam, tellers, seconden in gedeeld.runs:
+        features, verstuurd = tellers.get("features", 0), tellers.get("verstuurd", 0)
+        totaal_features += features
+        totaal_verstuurd += verstuurd
+        snelheid = features / seconden if seconden > 0 else 0
+        regels.append(f"{naam[:39]:<40}{features:>10}{verstuurd:>11}{seconden:>10.1f}{snelheid:>12.1f}")
+    snelheid = totaal_features / totaal_seconden if totaal_seconden > 0 else 0
+    regels.append(f"{'totaal':<40}{totaal_features:>10}{totaal_verstuurd:>11}{totaal_seconden:>10.1f}{snelheid:>12.1f}")
+    feedback.pushInfo("batch samenvatting:\n" + "\n".join(regels))
+    return {}
@@ -0,0 +1,275 @@
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from typing import Any
+
+import importlib
+import inspect
+import os
+import sys
+import urllib.request
+
+from qgis.core import (
+    QgsProcessingAlgorithm,
+    QgsProcessingContext,
+    QgsProcessingException,
+    QgsProcessingFeedback,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterString,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterFile,
+    QgsProcessing,
+    QgsVectorLayer,
+    QgsWkbTypes
+)
+
+# QGIS >= 3.30: Qgis.GeometryType, oudere versies: QgsWkbTypes.GeometryType (zoals in Ls2AttributenEindpunten)
+try:
+    from qgis.core import Qgis
+    PUNT_GEOMETRIE, LIJN_GEOMETRIE = Qgis.GeometryType.Point, Qgis.GeometryType.Line
+except (ImportError, AttributeError):
+    PUNT_GEOMETRIE, LIJN_GEOMETRIE = QgsWkbTypes.PointGeometry, QgsWkbTypes.LineGeometry
+
+
+class Ls2AttributenEindpuntenBatchAlgorithm(QgsProcessingAlgorithm):
+    """
+    Ls2-attributen(eind)Punten voor meerdere lagen in één run: modules, sessie,
+    connection pool en resultaat cache worden één keer opgezet en gedeeld.
+    """
+
+    INPUTS = "INPUTS"
+
+    def name(self) -> str:
+        return "ls2attributeneindpuntenbatch"
+
+    def displayName(self) -> str:
+        return "Ls2-attributen(eind)Punten (batch)"
+
+    def group(self) -> str:
+        return "Locatieservices2"
+
+    def groupId(self) -> str:
+        return "Locatieservices2"
+
+    def shortHelpString(self) -> str:
+        return (
+            """Bereken de relatieve weglocatie voor (eind)punten van meerdere lagen.
+        Zelfde verwerking als Ls2-attributen(eind)Punten, maar de modules worden één keer geladen
+        en sessie (connection pool) en resultaat cache worden over alle lagen gedeeld.
+        Invoer: een lijst lagen en/of een map met GeoPackages (alle punt- en lijnlagen).
+        De resultaten worden in de invoerlagen geschreven.
+        Op het einde volgt een overzicht van de doorvoer per laag en in totaal.
+        """
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterString(
+                name="cookie",
+                description="cookie AWV-applicatie (acm)",
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                name=self.INPUTS,
+                description="Input punt- en lijnlagen (per laag enkel geselecteerde features tenzij niets geselecteerd is)",
+                layerType=QgsProcessing.SourceType.TypeVectorAnyGeometry,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                name="map met GeoPackages",
+                description="map met GeoPackages (alle punt- en lijnlagen worden verwerkt)",
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                name="f_wegnummer",
+                description="naam van het wegnummerveld (in elke laag)",
+                defaultValue="wegnummer",
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="zoekafstand",
+                description="zoekafstand",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=5,
+                minValue=0,
+                maxValue=100
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                name="wegtype",
+                description="wegtype",
+                options=["alle wegen", "Genummerd"],
+                defaultValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                name="gebruik kant van de weg",
+                description="gebruik kant van de weg",
+                options=["true", "false"],
+                defaultValue=1
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="stuur wegnummer mee",
+                description="gekend wegnummer meesturen (LS2 zoekt enkel op die weg)",
+                defaultValue=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="aantal elementen per request",
+                description="aantal elementen per request (bovengrens bij adaptieve chunkgrootte)",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=1000,
+                minValue=1,
+                maxValue=100000
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="parallelle requests",
+                description="parallelle requests (aantal chunks tegelijk onderweg naar LS2)",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=1,
+                maxValue=16
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="ontdubbel eindpunten",
+                description="ontdubbel gedeelde eindpunten (elk punt maar één keer naar LS2)",
+                defaultValue=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="negeer resultaat cache",
+                description="negeer resultaat cache (alles opnieuw aan LS2 vragen, cache wordt ververst)",
+                defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="incrementeel",
+                description="incrementeel: sla features over waarvan de eindpunten sinds de vorige run niet wijzigden",
+                defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="connection pool grootte",
+                description="connection pool grootte (0 = aantal parallelle requests)",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                minValue=0,
+                maxValue=64
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="sessie idle timeout",
+                description="sessie: seconden dat een ongebruikte sessie herbruikbaar blijft",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=900,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="module cache ttl",
+                description="module cache: seconden zonder hercontrole op GitHub",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=3600,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="offline",
+                description="offline: gebruik enkel de gecachte modules",
+                defaultValue=False
+            )
+        )
+
+    def checkParameterValues(self, parameters, context):
+        # QgsProcessingParameterMultipleLayers kent maar één laagtype: vlakken en lagen zonder geometrie hier weigeren
+        for laag in self.parameterAsLayerList(parameters, self.INPUTS, context) or []:
+            if not isinstance(laag, QgsVectorLayer) or QgsWkbTypes.geometryType(laag.wkbType()) not in (
+                    PUNT_GEOMETRIE, LIJN_GEOMETRIE):
+                return False, f"{laag.name()} is geen punt- of lijnlaag"
+        return super().checkParameterValues(parameters, context)
+
+    def processAlgorithm(
+            self,
+            parameters: dict[str, Any],
+            context: QgsProcessingContext,
+            feedback: QgsProcessingFeedback,
+    ):
+        """
+        Laad Ls2AttributenEindpunten en verwerk alle lagen met batch_main.
+        """
+        def load_module_from_github(url, module_name):
+            # Bootstrap: enkel Ls2AttributenEindpunten zelf ophalen als er nog geen bruikbare kopie is;
+            # module cache, manifest en verversen doet daarna zijn eigen load_module_from_github
+            cache_dir = os.path.join(os.path.expanduser("~"), ".qgis_module_cache")
+            local_path = os.path.join(cache_dir, module_name + ".py")
+            offline = parameters.get("offline", False)
+            if cache_dir not in sys.path:
+                sys.path.append(cache_dir)
+
+            module = sys.modules.get(module_name)
+            if module is None and os.path.exists(local_path):
+                importlib.invalidate_caches()
+                module = importlib.import_module(module_name)
+            kan_verversen = module is not None and "modules" in inspect.signature(module.load_module_from_github).parameters
+            if not kan_verversen and not offline:
+                os.makedirs(cache_dir, exist_ok=True)
+                # Eerst naar tijdelijk bestand, dan atomair vervangen (parallelle runs)
+                tmp_pad = f"{local_path}.{os.getpid()}.tmp"
+                urllib.request.urlretrieve(url, tmp_pad)
+                os.replace(tmp_pad, local_path)
+                importlib.invalidate_caches()
+                module = importlib.reload(module) if module is not None else importlib.import_module(module_name)
+                kan_verversen = True
+            if module is None:
+                raise QgsProcessingException(f"Offline modus: geen lokale kopie van {module_name}")
+
+            if kan_verversen:
+                geladen = module.load_module_from_github(
+                    feedback, parameters.get("module cache ttl", 3600), offline, modules={module_name: url})
+                module = geladen.get(module_name, module)
+            feedback.pushInfo(f"Module geladen: {module_name} -> {getattr(module, '__file__', '')}")
+            return module
+
+        raw_url = "https://raw.githubusercontent.com/joachimdero/toolboxScriptsQgis/refs/heads/master/toolboxLocatieservices2/Ls2AttributenEindpunten.py"
+        Ls2AttributenEindpunten = load_module_from_github(raw_url, "Ls2AttributenEindpunten")
+
+        results = Ls2AttributenEindpunten.batch_main(self, context, parameters, feedback) or {}
+        feedback.pushInfo("einde toolboxscript")
+
+        return results
+
+    def createInstance(self):
+        return self.__class__()
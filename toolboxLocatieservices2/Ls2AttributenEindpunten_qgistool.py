@@ -12,6 +12,7 @@
 from typing import Any, Optional
 
 import importlib.util
+import inspect
 import os
 import sys
 import urllib.request
@@ -26,6 +27,10 @@ from qgis.core import (
     QgsProcessingParameterField,
     QgsProcessingParameterNumber,
     QgsProcessingParameterEnum,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterFile,
     QgsProcessing
 )
 from qgis import processing
@@ -162,16 +167,274 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
                 defaultValue=1
             )
         )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="stuur wegnummer mee",
+                description="gekend wegnummer meesturen (LS2 zoekt enkel op die weg)",
+                defaultValue=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="groepeer per wegnummer",
+                description="chunks groeperen per wegnummer (geen checkpoint mogelijk)",
+                defaultValue=False
+            )
+        )
         self.addParameter(
             QgsProcessingParameterNumber(
                 name="aantal elementen per request",
-                description="aantal elementen per request",
+                description="aantal elementen per request (bovengrens bij adaptieve chunkgrootte)",
                 type=QgsProcessingParameterNumber.Integer,
-                defaultValue=0,
+                defaultValue=1000,
                 minValue=1,  # optioneel
                 maxValue=100000  # optioneel
             )
         )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="adaptieve chunkgrootte",
+                description="adaptieve chunkgrootte (bijsturen op basis van responstijd en fouten)",
+                defaultValue=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="parallelle requests",
+                description="parallelle requests (aantal chunks tegelijk onderweg naar LS2)",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=1,
+                maxValue=16
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="aantal pogingen",
+                description="aantal pogingen per LS2-request (exponentiële backoff bij fouten)",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=3,
+                minValue=1,
+                maxValue=10
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="hervat vanaf checkpoint",
+                description="hervat vanaf checkpoint (na een onderbroken run)",
+                defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="ontdubbel eindpunten",
+                description="ontdubbel gedeelde eindpunten (elk punt maar één keer naar LS2)",
+                defaultValue=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="snaptolerantie",
+                description="snaptolerantie ontdubbeling (meter, ook bij een geografisch CRS)",
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=0.001,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="negeer resultaat cache",
+                description="negeer resultaat cache (alles opnieuw aan LS2 vragen, cache wordt ververst)",
+                defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="resultaat cache max aantal",
+                description="resultaat cache: maximum aantal bewaarde punten",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=1000000,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="resultaat cache max leeftijd (dagen)",
+                description="resultaat cache: maximum leeftijd (dagen)",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=30,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="schrijf interval (features)",
+                description="resultaten wegschrijven per ... features",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=5000,
+                minValue=1
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="schrijf interval (seconden)",
+                description="resultaten minstens om de ... seconden wegschrijven",
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=30,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="snelle bulk-update",
+                description="snelle bulk-update voor PostGIS/GeoPackage (tijdelijke tabel + één UPDATE)",
+                defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="incrementeel",
+                description="incrementeel: sla features over waarvan de eindpunten sinds de vorige run niet wijzigden "
+                            "(niet met een uitvoerlaag)",
+                defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                name=self.OUTPUT,
+                description="Uitvoerlaag (optioneel; leeg = resultaten in de invoerlaag schrijven)",
+                optional=True,
+                createByDefault=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                name="FAILED",
+                description="mislukte features (optioneel; fid, eindpunt en foutklasse per mislukt punt)",
+                type=QgsProcessing.SourceType.TypeVectorPoint,
+                optional=True,
+                createByDefault=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="max foutvoorbeelden per klasse",
+                description="max aantal gelogde voorbeelden per foutklasse",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=5,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                name="rapport",
+                description="run rapport (optioneel, JSON of CSV per chunk)",
+                fileFilter="JSON (*.json);;CSV (*.csv)",
+                optional=True,
+                createByDefault=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                name="lokale referentie gpkg",
+                description="lokale referentie (GeoPackage; LS2 enkel voor punten die lokaal niet eenduidig zijn)",
+                behavior=QgsProcessingParameterFile.File,
+                fileFilter="GeoPackage (*.gpkg)",
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                name="referentiepunten (import)",
+                description="referentiepunten om te importeren (als de GeoPackage nog niet bestaat)",
+                types=[QgsProcessing.SourceType.TypeVectorPoint],
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                name="veld wegnummer referentiepunten",
+                description="wegnummer van de referentiepunten",
+                parentLayerParameterName="referentiepunten (import)",
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                name="veld opschrift referentiepunten",
+                description="opschrift van de referentiepunten",
+                parentLayerParameterName="referentiepunten (import)",
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                name="wegassen (import)",
+                description="wegassen om te importeren (als de GeoPackage nog niet bestaat)",
+                types=[QgsProcessing.SourceType.TypeVectorLine],
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                name="veld wegnummer wegassen",
+                description="wegnummer van de wegassen",
+                parentLayerParameterName="wegassen (import)",
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                name="opname modus",
+                description="LS2 opname (afspelen: zonder netwerk en cookie, antwoorden uit het opname bestand)",
+                options=["uit", "opnemen", "afspelen"],
+                defaultValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                name="opname bestand",
+                description="opname bestand (wordt aangevuld bij opnemen)",
+                behavior=QgsProcessingParameterFile.File,
+                fileFilter="LS2 opname (*.jsonl.gz)",
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="connection pool grootte",
+                description="connection pool grootte (0 = aantal parallelle requests)",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                minValue=0,
+                maxValue=64
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="sessie idle timeout",
+                description="sessie: seconden dat een ongebruikte sessie herbruikbaar blijft",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=900,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                name="module cache ttl",
+                description="module cache: seconden zonder hercontrole op GitHub",
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=3600,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                name="offline",
+                description="offline: gebruik enkel de gecachte modules",
+                defaultValue=False
+            )
+        )
 
     def processAlgorithm(
             self,
@@ -185,32 +448,42 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         import importlib, subprocess, sys
 
         def load_module_from_github(url, module_name):
+            # Bootstrap: enkel Ls2AttributenEindpunten zelf ophalen als er nog geen bruikbare kopie is;
+            # module cache, manifest en verversen doet daarna zijn eigen load_module_from_github
             cache_dir = os.path.join(os.path.expanduser("~"), ".qgis_module_cache")
-            os.makedirs(cache_dir, exist_ok=True)
-
             local_path = os.path.join(cache_dir, module_name + ".py")
-            urllib.request.urlretrieve(url, local_path)
-
-            # Voeg cache_dir één keer toe
+            offline = parameters.get("offline", False)
             if cache_dir not in sys.path:
                 sys.path.append(cache_dir)
 
-            # Invalideer caches zodat Python nieuwe code ziet
-            importlib.invalidate_caches()
-
-            # Importeer of herlaad
-            if module_name in sys.modules:
-                module = importlib.reload(sys.modules[module_name])
-            else:
+            module = sys.modules.get(module_name)
+            if module is None and os.path.exists(local_path):
+                importlib.invalidate_caches()
                 module = importlib.import_module(module_name)
+            kan_verversen = module is not None and "modules" in inspect.signature(module.load_module_from_github).parameters
+            if not kan_verversen and not offline:
+                os.makedirs(cache_dir, exist_ok=True)
+                # Eerst naar tijdelijk bestand, dan atomair vervangen (parallelle runs)
+                tmp_pad = f"{local_path}.{os.getpid()}.tmp"
+                urllib.request.urlretrieve(url, tmp_pad)
+                os.replace(tmp_pad, local_path)
+                importlib.invalidate_caches()
+                module = importlib.reload(module) if module is not None else importlib.import_module(module_name)
+                kan_verversen = True
+            if module is None:
+                raise QgsProcessingException(f"Offline modus: geen lokale kopie van {module_name}")
 
-            feedback.pushInfo(f"Module herladen: {module_name} -> {getattr(module, '__file__', '')}")
+            if kan_verversen:
+                geladen = module.load_module_from_github(
+                    feedback, parameters.get("module cache ttl", 3600), offline, modules={module_name: url})
+                module = geladen.get(module_name, module)
+            feedback.pushInfo(f"Module geladen: {module_name} -> {getattr(module, '__file__', '')}")
             return module
 
         raw_url = "https://raw.githubusercontent.com/joachimdero/toolboxScriptsQgis/refs/heads/master/toolboxLocatieservices2/Ls2AttributenEindpunten.py"
         Ls2AttributenEindpunten = load_module_from_github(raw_url, "Ls2AttributenEindpunten")
 
-        Ls2AttributenEindpunten.main(self, context, parameters, feedback)
+        results = Ls2AttributenEindpunten.main(self, context, parameters, feedback) or {}
 
         # Retrieve the feature source and sink. The 'dest_id' variable is used
         # to uniquely identify the feature sink, and must be included in the
@@ -227,7 +500,7 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         feedback.pushInfo("einde toolboxscript")
 
-        return {}
+        return results
 
     def createInstance(self):
         return self.__class__()
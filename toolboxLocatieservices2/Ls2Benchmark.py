@@ -0,0 +1,667 @@
+"""
+Benchmark voor Ls2AttributenEindpunten zonder netwerk en zonder productie-LS2.
+
+- lokale stand-in server voor het LS2 puntlocatie endpoint (latentie, foutkans, response-vorm instelbaar)
+- synthetische memory-lagen: Point, LineString en MultiLineString met instelbare grootte en vertexdichtheid
+- draait main() per scenario (chunkgrootte x parallelle requests x ontdubbeling x wegnummer) en rapporteert
+  features/s, requests/s, locaties/s en geheugen
+
+Headless te starten met de Python van QGIS (maakt zelf een QgsApplication zonder GUI):
+
+    python3 Ls2Benchmark.py --aantal 5000 --types LineString,MultiLineString --chunks 250,1000 --parallel 1,4
+
+Standaard draait elk scenario in een apart proces zodat het geheugen per scenario zuiver gemeten wordt.
+Met --in-proces (bv. onder qgis_process of de QGIS Python-console) draait alles in hetzelfde proces;
+de piek-RSS is dan cumulatief.
+
+Geheugen van de chunk-werkset (locaties + indices + cachesleutels + wat het transport opbouwt + resultaatwijzigingen),
+per 100k eindpunten, elk in een eigen proces: geneste dicts per punt (vorige weergave) tegenover
+CompacteLocaties/CompacteWijzigingen, met in beide gevallen de dicts die Locatieservices2 aan de transportgrens
+krijgt (als_json). Het geheugen van een volledige run staat als piek RSS bij elk scenario.
+
+    python3 Ls2Benchmark.py --geheugen 100000
+
+Micro-benchmark van de eindpuntextractie (asPolyline/asMultiPolyline tegenover eindpunten() via constGet)
+op synthetische lijnen met veel vertices:
+
+    python3 Ls2Benchmark.py --eindpunten 10000
+
+Controle van de snelle bulk-update: een met GDAL aangemaakte GeoPackage (met rtree-triggers) wordt één keer
+met changeAttributeValues en één keer via AttribuutSchrijver(snel=True) bijgewerkt, waarna de rijen
+(attributen, geometrie en rtree) identiek moeten zijn; met --postgres ook voor bulk_update_postgres:
+
+    python3 Ls2Benchmark.py --bulk 5000 [--postgres "dbname=test host=localhost user=..."]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPT_DIR not in sys.path:
+    sys.path.insert(0, SCRIPT_DIR)
+
+CRS = "EPSG:31370"
+
+# Stand-in modules: worden in een tijdelijke module cache gezet en in offline modus geladen,
+# zodat main() exact dezelfde laadweg volgt als in productie.
+STANDIN_LOCATIESERVICES2 = '''"""Stand-in voor Locatieservices2 (benchmark): POST naar de lokale LS2 stand-in server."""
+import json
+import urllib.request
+
+URL = {url!r}
+
+F_TYPE = {{naam: ("TEXT",) for naam in (
+    "wegnummer",
+    "begin_refpunt_wegnr", "begin_refpunt_opschrift", "begin_refpunt_afstand",
+    "eind_refpunt_wegnr", "eind_refpunt_opschrift", "eind_refpunt_afstand",
+    "refpunt_wegnr", "refpunt_opschrift", "refpunt_afstand",
+)}}
+
+
+def request_ls2_puntlocatie(locaties, omgeving, zoekafstand, crs, session, gebruik_kant_van_de_weg, **kwargs):
+    body = json.dumps({{"locaties": locaties, "zoekafstand": zoekafstand, "kant": gebruik_kant_van_de_weg}})
+    request = urllib.request.Request(URL, data=body.encode("utf-8"), headers={{"Content-Type": "application/json"}})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        return json.loads(response.read())
+'''
+
+STANDIN_AUTHENTICATIE = '''"""Stand-in voor AuthenticatieProxyAcmAwv (benchmark): geen cookie of proxy nodig."""
+
+
+def prepareSession(cookie=None):
+    return None
+
+
+def proxieHandler(session):
+    return session
+'''
+
+
+class Ls2StandIn:
+    """
+    Lokale HTTP-server die het LS2 puntlocatie endpoint nabootst.
+    - latentie_ms + latentie_per_locatie_ms * aantal locaties per request
+      (+ latentie_zonder_wegnummer_ms per locatie zonder wegnummer)
+    - vorm: 'volledig' (1 geldige response per locatie), 'fouten' (error-response per locatie)
+      of 'kort' (laatste response ontbreekt, test het opnieuw vragen)
+    - foutkans: bij 'fouten' de kans per locatie, anders de kans op een 503 voor het hele
+      request (test retries en splitsing)
+    """
+
+    def __init__(self, latentie_ms=50.0, latentie_per_locatie_ms=0.5, foutkans=0.0, vorm="volledig",
+                 latentie_zonder_wegnummer_ms=0.0):
+        self.latentie_ms = latentie_ms
+        self.latentie_per_locatie_ms = latentie_per_locatie_ms
+        self.latentie_zonder_wegnummer_ms = latentie_zonder_wegnummer_ms
+        self.foutkans = foutkans
+        self.vorm = vorm
+        self.aantal_requests = 0
+        self.aantal_locaties = 0
+        self._lock = threading.Lock()
+
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                lengte = int(self.headers.get("Content-Length", 0))
+                locaties = json.loads(self.rfile.read(lengte)).get("locaties", [])
+                status, antwoord = standin.beantwoord(locaties)
+                inhoud = json.dumps(antwoord).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(inhoud)))
+                self.end_headers()
+                self.wfile.write(inhoud)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/locatieservices2/puntlocatie/batch"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.aantal_requests = 0
+            self.aantal_locaties = 0
+
+    def beantwoord(self, locaties):
+        with self._lock:
+            self.aantal_requests += 1
+            self.aantal_locaties += len(locaties)
+        # zonder wegnummer moet LS2 alle wegen binnen de zoekafstand afzoeken
+        zonder_wegnummer = sum(1 for locatie in locaties if not locatie.get("wegnummer"))
+        time.sleep((self.latentie_ms + self.latentie_per_locatie_ms * len(locaties)
+                    + self.latentie_zonder_wegnummer_ms * zonder_wegnummer) / 1000)
+        if self.vorm != "fouten" and self.foutkans and random.random() < self.foutkans:
+            return 503, {"error": "stand-in: service unavailable"}
+
+        responses = []
+        for locatie in locaties:
+            if self.vorm == "fouten" and random.random() < self.foutkans:
+                responses.append({"error": {"message": "geen weg gevonden binnen zoekafstand"}})
+                continue
+            x, y = locatie["geometry"]["coordinates"][:2]
+            wegnummer = (locatie.get("wegnummer") or {}).get("nummer") or f"N{int(y) % 97}"
+            responses.append({"success": {"relatief": {
+                "referentiepunt": {"wegnummer": {"nummer": wegnummer}, "opschrift": round(x / 1000, 1)},
+                "afstand": round(x % 100, 1),
+                "wegnummer": {"nummer": wegnummer},
+            }}})
+        if self.vorm == "kort" and responses:
+            responses.pop()
+        return 200, responses
+
+
+def start_qgis():
+    """Start een headless QgsApplication als er nog geen is (bare Python); onder qgis_process bestaat ze al."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from qgis.core import QgsApplication
+    if QgsApplication.instance() is not None:
+        return None
+    app = QgsApplication([], False)
+    app.initQgis()
+    return app
+
+
+def maak_laag(geom_type, aantal, vertices=10, gedeelde_knopen=True):
+    """
+    Synthetische memory-laag in Lambert 72. Lijnen liggen in rijen van 100 features;
+    met gedeelde_knopen begint elke lijn op het eindpunt van de vorige (zoals een wegennet),
+    wat ontdubbeling een realistische kans geeft.
+    """
+    from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer
+
+    layer = QgsVectorLayer(f"{geom_type}?crs={CRS}&field=wegnummer:string(20)", f"benchmark_{geom_type}", "memory")
+    stap = 100.0  # lengte van een feature in m
+    features = []
+    for i in range(aantal):
+        x0 = 100000 + (i % 100) * stap + (0 if gedeelde_knopen else 10 * (i % 2))
+        y0 = 150000 + (i // 100) * 250
+        feature = QgsFeature(layer.fields())
+        feature.setAttribute(0, f"N{(i // 100) % 97}")
+        if geom_type == "Point":
+            geom = QgsGeometry.fromPointXY(QgsPointXY(x0, y0))
+        else:
+            aantal_vertices = max(2, vertices)
+            # tussenliggende vertices zigzaggen, begin- en eindpunt liggen op de rij
+            punten = [
+                QgsPointXY(x0 + stap * j / (aantal_vertices - 1), y0 + (5 if 0 < j < aantal_vertices - 1 and j % 2 else 0))
+                for j in range(aantal_vertices)
+            ]
+            if geom_type == "MultiLineString":
+                midden = len(punten) // 2
+                geom = QgsGeometry.fromMultiPolylineXY([punten[:midden + 1], punten[midden:]])
+            else:
+                geom = QgsGeometry.fromPolylineXY(punten)
+        feature.setGeometry(geom)
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+class _Algoritme:
+    """Minimale stand-in voor het processing-algoritme waar main() zijn parameters aan vraagt."""
+
+    def __init__(self, layer, rapport_pad):
+        self.layer = layer
+        self.rapport_pad = rapport_pad
+
+    def parameterAsVectorLayer(self, parameters, name, context):
+        return self.layer
+
+    def parameterDefinition(self, name):
+        # geen OUTPUT-sink (in-place op de memory-laag), wel een rapport
+        return True if name == "rapport" else None
+
+    def parameterAsFileOutput(self, parameters, name, context):
+        return self.rapport_pad
+
+
+def bereid_module_cache_voor(cache_dir, url):
+    """Zet de stand-in modules in een tijdelijke module cache en laat Ls2AttributenEindpunten die gebruiken."""
+    import Ls2AttributenEindpunten as ls2
+
+    os.makedirs(cache_dir, exist_ok=True)
+    bestanden = {
+        "Locatieservices2.py": STANDIN_LOCATIESERVICES2.format(url=url),
+        "AuthenticatieProxyAcmAwv.py": STANDIN_AUTHENTICATIE,
+        "modulesFromGithub.json": json.dumps({
+            "Locatieservices2": "standin:Locatieservices2",
+            "AuthenticatieProxyAcmAwv": "standin:AuthenticatieProxyAcmAwv",
+        }),
+    }
+    for naam, inhoud in bestanden.items():
+        with open(os.path.join(cache_dir, naam), "w", encoding="utf-8") as f:
+            f.write(inhoud)
+
+    ls2.CACHE_DIR = cache_dir
+    ls2.MANIFEST_PAD = os.path.join(cache_dir, "manifest.json")
+    ls2.RESULTAAT_CACHE_PAD = os.path.join(cache_dir, "ls2_resultaten.sqlite")
+    ls2.CHECKPOINT_DIR = os.path.join(cache_dir, "checkpoints")
+    return ls2
+
+
+def draai_scenario(scenario, url, cache_dir):
+    """Draai main() voor één scenario en geef de metingen terug (dict)."""
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback
+
+    ls2 = bereid_module_cache_voor(cache_dir, url)
+    layer = maak_laag(scenario["type"], scenario["aantal"], scenario["vertices"])
+    rapport_pad = os.path.join(cache_dir, f"rapport_{os.getpid()}_{time.monotonic_ns()}.json")
+    parameters = {
+        "INPUT": layer,
+        "cookie": "",
+        "f_wegnummer": "wegnummer",
+        "zoekafstand": 20,
+        "gebruik kant van de weg": False,
+        "aantal elementen per request": scenario["chunk"],
+        "adaptieve chunkgrootte": scenario.get("adaptief", False),
+        "parallelle requests": scenario["parallel"],
+        "ontdubbel eindpunten": scenario["ontdubbel"],
+        "stuur wegnummer mee": scenario.get("wegnummer", True),
+        "groepeer per wegnummer": scenario.get("wegnummer", True),
+        "negeer resultaat cache": True,
+        "offline": True,
+    }
+
+    begin = time.monotonic()
+    ls2.main(_Algoritme(layer, rapport_pad), QgsProcessingContext(), parameters, QgsProcessingFeedback())
+    seconden = time.monotonic() - begin
+
+    with open(rapport_pad, encoding="utf-8") as f:
+        rapport = json.load(f)
+    os.remove(rapport_pad)
+    tellers = rapport["tellers"]
+    return dict(
+        scenario,
+        seconden=round(seconden, 3),
+        features_per_s=round(scenario["aantal"] / seconden, 1),
+        locaties_per_s=round(tellers.get("punten", 0) / seconden, 1),
+        verstuurd=tellers.get("verstuurd", 0),
+        fouten=tellers.get("fouten", 0),
+        fases={naam: round(waarde, 3) for naam, waarde in rapport["fases"].items()},
+        piek_rss_mb=rapport["piek_rss_mb"],
+    )
+
+
+def eindpunten_via_polyline(geom):
+    """Vorige extractie: alle vertices als QgsPointXY kopiëren om enkel begin en eind te houden."""
+    if geom.isMultipart():
+        lijnen = geom.asMultiPolyline()
+    else:
+        lijnen = [geom.asPolyline()]
+    return [(lijn[0].x(), lijn[0].y(), lijn[-1].x(), lijn[-1].y()) for lijn in lijnen if lijn]
+
+
+def eindpunten_benchmark(vertices, aantal=200, herhalingen=5):
+    """Tijd per feature voor beide extracties op aantal lijnen (helft LineString, helft MultiLineString)."""
+    from qgis.core import QgsGeometry, QgsPointXY
+    import Ls2AttributenEindpunten as ls2
+
+    geometrieen = []
+    for i in range(aantal):
+        punten = [QgsPointXY(100000.0 + j, 150000.0 + i * 10 + (j % 2)) for j in range(vertices)]
+        if i % 2:
+            midden = vertices // 2
+            geometrieen.append(QgsGeometry.fromMultiPolylineXY([punten[:midden + 1], punten[midden:]]))
+        else:
+            geometrieen.append(QgsGeometry.fromPolylineXY(punten))
+
+    resultaten = []
+    for naam, functie in (("asPolyline", eindpunten_via_polyline), ("constGet", ls2.eindpunten)):
+        beste = None
+        for _ in range(herhalingen):
+            begin = time.perf_counter()
+            for geom in geometrieen:
+                functie(geom)
+            seconden = time.perf_counter() - begin
+            beste = seconden if beste is None else min(beste, seconden)
+        resultaat = {"methode": naam, "vertices": vertices, "us_per_feature": round(1e6 * beste / aantal, 1)}
+        resultaten.append(resultaat)
+        print(f"{naam:<12} {vertices} vertices: {resultaat['us_per_feature']:>10.1f} µs per feature", flush=True)
+    oud, nieuw = resultaten
+    if nieuw["us_per_feature"]:
+        print(f"constGet is {oud['us_per_feature'] / nieuw['us_per_feature']:.0f}x sneller")
+    return resultaten
+
+
+def bouw_werkset(vorm, aantal):
+    """
+    Bouw de werkset van één chunk met aantal eindpunten van lijnen (begin + eind per feature), met in
+    elke vorm de cachesleutels en wat aan de transportgrens opgebouwd wordt:
+    'dicts' = een geneste dict per locatie, (fid, deel, eindpunt)-tuples, cachesleutel per locatie en
+    {fid: {veld_idx: waarde}}; 'compact' = CompacteLocaties + cachesleutels + de dicts van als_json
+    (request_ls2_puntlocatie) + CompacteWijzigingen.
+    """
+    import Ls2AttributenEindpunten as ls2
+
+    kolommen = (0, 1, 2, 3, 4, 5, 6)
+    if vorm == "dicts":
+        crs_blok = ls2.maak_crs_blok(CRS)
+        locaties, indices, sleutels, changes = [], [], [], {}
+        for i in range(aantal):
+            fid, eindpunt = i // 2, (ls2.BEGIN, ls2.EIND)[i % 2]
+            locatie = {
+                "geometry": {"crs": crs_blok, "type": "Point", "coordinates": [100000.0 + i, 150000.0 + i]},
+                "wegnummer": {"nummer": f"N{fid % 97}"},
+            }
+            locaties.append(locatie)
+            indices.append((fid, 0, eindpunt))
+            sleutels.append(ls2.Ls2ResultaatCache.sleutel(locatie, CRS, 20, False))
+        for fid in range(aantal // 2):
+            changes[fid] = dict(zip(kolommen, (f"N{fid % 97}", f"N{fid % 97}", fid * 0.1, fid * 0.2,
+                                               f"N{fid % 97}", fid * 0.3, fid * 0.4)))
+        return locaties, indices, sleutels, changes
+
+    locaties = ls2.CompacteLocaties(CRS)
+    for i in range(aantal):
+        fid = i // 2
+        locaties.voeg_toe(fid, 0, (ls2.BEGIN, ls2.EIND)[i % 2], 100000.0 + i, 150000.0 + i, f"N{fid % 97}")
+    sleutels = [
+        ls2.Ls2ResultaatCache.sleutel_xy(*locaties.coordinaten(i), locaties.wegnummer(i), CRS, 20, False)
+        for i in range(len(locaties))
+    ]
+    transport = locaties.als_json()
+    changes = ls2.CompacteWijzigingen(kolommen)
+    for fid in range(aantal // 2):
+        changes.voeg_toe(fid, (f"N{fid % 97}", f"N{fid % 97}", fid * 0.1, fid * 0.2,
+                               f"N{fid % 97}", fid * 0.3, fid * 0.4))
+    return locaties, sleutels, transport, changes
+
+
+def meet_geheugen(vorm, aantal):
+    """Piek-RSS toename (MB) door het opbouwen van de werkset, ook herleid naar 100k eindpunten."""
+    import Ls2AttributenEindpunten as ls2
+
+    basis = ls2.piek_rss_mb()
+    werkset = bouw_werkset(vorm, aantal)
+    piek = ls2.piek_rss_mb()
+    del werkset
+    if basis is None or piek is None:
+        return {"vorm": vorm, "aantal": aantal, "mb": None, "mb_per_100k": None}
+    return {"vorm": vorm, "aantal": aantal, "mb": round(piek - basis, 1),
+            "mb_per_100k": round((piek - basis) * 100000 / aantal, 1)}
+
+
+def geheugen_benchmark(aantal):
+    resultaten = []
+    for vorm in ("dicts", "compact"):
+        uitvoer = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--meet-geheugen", vorm, "--aantal", str(aantal)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        resultaat = json.loads(uitvoer.strip().splitlines()[-1])
+        resultaten.append(resultaat)
+        print(f"{vorm:<10} {aantal} eindpunten: +{resultaat['mb'] or 0:.1f} MB piek RSS"
+              f"  ({resultaat['mb_per_100k'] or 0:.1f} MB per 100k eindpunten)", flush=True)
+    dicts, compact = resultaten
+    if dicts["mb"] and compact["mb"]:
+        print(f"compact gebruikt {compact['mb'] / dicts['mb']:.0%} van het geheugen van de dict-weergave")
+    return resultaten
+
+
+BULK_VELDEN = (
+    ("wegnummer", "String"), ("begin_refpunt_wegnr", "String"), ("begin_refpunt_opschrift", "Real"),
+    ("begin_refpunt_afstand", "Integer"), ("eind_refpunt_wegnr", "String"), ("eind_refpunt_opschrift", "Real"),
+    ("eind_refpunt_afstand", "Integer"),
+)
+
+
+def maak_bulk_gpkg(pad, aantal):
+    """GeoPackage met lijnlaag 'wegen' via GDAL (met rtree en de bijhorende triggers); oneven features hebben een wegnummer."""
+    from osgeo import ogr, osr
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(31370)
+    ds = ogr.GetDriverByName("GPKG").CreateDataSource(pad)
+    laag = ds.CreateLayer("wegen", srs, ogr.wkbLineString, options=["SPATIAL_INDEX=YES"])
+    for naam, soort in BULK_VELDEN:
+        laag.CreateField(ogr.FieldDefn(naam, getattr(ogr, f"OFT{soort}")))
+    laag.StartTransaction()
+    for i in range(aantal):
+        feature = ogr.Feature(laag.GetLayerDefn())
+        if i % 2:
+            feature.SetField("wegnummer", f"N{i % 97}")
+        feature.SetGeometry(ogr.CreateGeometryFromWkt(
+            f"LINESTRING ({100000 + i} {150000 + i}, {100050 + i} {150005 + i}, {100100 + i} {150000 + i})"))
+        laag.CreateFeature(feature)
+    laag.CommitTransaction()
+    ds = None
+
+
+def bulk_wijzigingen(ls2, layer):
+    """
+    Resultaatwijzigingen zoals schrijf_resultaten_naar_layer ze maakt: het wegnummer enkel waar het ontbrak
+    (anders NIET_GEZET), NULL-waarden voor fouten en een deel van de features ongewijzigd.
+    """
+    kolommen = [layer.fields().indexFromName(naam) for naam, _ in BULK_VELDEN]
+    wijzigingen = ls2.CompacteWijzigingen(kolommen)
+    for feature in layer.getFeatures():
+        fid = feature.id()
+        if fid % 5 == 0:
+            continue
+        wegnummer = ls2.NIET_GEZET if feature["wegnummer"] else f"R{fid % 13}"
+        if fid % 7 == 0:
+            waarden = (wegnummer, None, None, None, None, None, None)
+        else:
+            waarden = (wegnummer, f"N{fid % 97}", fid / 10, fid % 100, f"N{fid % 97}", fid / 10 + 1, (fid + 50) % 100)
+        wijzigingen.voeg_toe(fid, waarden)
+    return wijzigingen
+
+
+def bulk_rijen(layer):
+    layer.dataProvider().reloadData()
+    return {feature.id(): (feature.attributes(), feature.geometry().asWkt(3)) for feature in layer.getFeatures()}
+
+
+def vergelijk_bulk(ls2, referentie, bulk):
+    """Werk referentie bij met changeAttributeValues en bulk via AttribuutSchrijver(snel=True); vergelijk de rijen."""
+    wijzigingen = bulk_wijzigingen(ls2, referentie)
+    assert bulk_wijzigingen(ls2, bulk).als_dict() == wijzigingen.als_dict(), "lagen verschillen al voor de update"
+    assert referentie.dataProvider().changeAttributeValues(ls2.als_wijzigingen_dict(wijzigingen))
+
+    schrijver = ls2.AttribuutSchrijver(bulk, flush_aantal=10 ** 9, flush_seconden=10 ** 9, snel=True)
+    assert schrijver.bulk is not None, f"geen bulk-update mogelijk voor {bulk.source()}"
+    schrijver.voeg_toe(wijzigingen)
+    schrijver.flush()
+    assert schrijver.bulk is not None, "bulk-update mislukte (terugval op changeAttributeValues)"
+
+    verwacht, gekregen = bulk_rijen(referentie), bulk_rijen(bulk)
+    verschillen = [fid for fid in verwacht if verwacht[fid] != gekregen.get(fid)]
+    assert verwacht.keys() == gekregen.keys() and not verschillen, f"verschillende rijen, bv. fid {verschillen[:5]}"
+    met_wegnummer = sum(1 for rij in wijzigingen.rijen if rij[0] is ls2.NIET_GEZET)
+    return {"rijen": len(verwacht), "gewijzigd": len(wijzigingen), "wegnummer_behouden": met_wegnummer,
+            "wegnummer_gezet": len(wijzigingen) - met_wegnummer}
+
+
+def rtree_rijen(pad):
+    conn = sqlite3.connect(pad)
+    try:
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok", f"{pad} is beschadigd"
+        return conn.execute("SELECT * FROM rtree_wegen_geom ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def bulk_check(aantal, postgres=None):
+    """Controleer bulk_update_gpkg (en met postgres bulk_update_postgres) tegen changeAttributeValues."""
+    from qgis.core import QgsDataSourceUri, QgsVectorLayer
+    import Ls2AttributenEindpunten as ls2
+
+    resultaten = []
+    with tempfile.TemporaryDirectory(prefix="ls2_bulk_") as map_:
+        paden = [os.path.join(map_, f"{naam}.gpkg") for naam in ("referentie", "bulk")]
+        for pad in paden:
+            maak_bulk_gpkg(pad, aantal)
+        referentie, bulk = (QgsVectorLayer(f"{pad}|layername=wegen", "wegen", "ogr") for pad in paden)
+        resultaat = {"provider": "gpkg", **vergelijk_bulk(ls2, referentie, bulk)}
+        del referentie, bulk
+        assert rtree_rijen(paden[0]) == rtree_rijen(paden[1]), "rtree verschilt na de bulk-update"
+        resultaten.append(resultaat)
+
+        if postgres:
+            from osgeo import ogr
+            maak_bulk_gpkg(os.path.join(map_, "bron.gpkg"), aantal)
+            bron = ogr.Open(os.path.join(map_, "bron.gpkg"))
+            doel = ogr.Open(f"PG:{postgres}", update=1)
+            lagen = []
+            for naam in ("ls2_bulk_referentie", "ls2_bulk_bulk"):
+                doel.CopyLayer(bron.GetLayerByName("wegen"), naam, ["OVERWRITE=YES", "FID=fid", "GEOMETRY_NAME=geom"])
+                uri = QgsDataSourceUri(postgres)
+                uri.setDataSource("public", naam, "geom", "", "fid")
+                lagen.append(QgsVectorLayer(uri.uri(False), naam, "postgres"))
+            bron = doel = None
+            resultaten.append({"provider": "postgres", **vergelijk_bulk(ls2, *lagen)})
+
+    for resultaat in resultaten:
+        print(f"{resultaat['provider']:<9} {resultaat['rijen']} rijen, {resultaat['gewijzigd']} gewijzigd "
+              f"(wegnummer gezet: {resultaat['wegnummer_gezet']}, behouden: {resultaat['wegnummer_behouden']}): "
+              f"bulk-update identiek aan changeAttributeValues", flush=True)
+    return resultaten
+
+
+def scenarios(args):
+    for geom_type, chunk, parallel, ontdubbel, wegnummer in itertools.product(
+            args.types.split(","), args.chunks, args.parallel, args.ontdubbel, args.wegnummer):
+        yield {
+            "type": geom_type,
+            "aantal": args.aantal,
+            "vertices": args.vertices,
+            "chunk": chunk,
+            "parallel": parallel,
+            "ontdubbel": bool(ontdubbel),
+            "wegnummer": bool(wegnummer),
+        }
+
+
+def _getallen(tekst):
+    return [int(waarde) for waarde in tekst.split(",") if waarde]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--aantal", type=int, default=2000, help="features per laag")
+    parser.add_argument("--vertices", type=int, default=10, help="vertices per lijn(deel)")
+    parser.add_argument("--types", default="Point,LineString,MultiLineString")
+    parser.add_argument("--chunks", type=_getallen, default=[250, 1000], help="chunkgroottes, komma-gescheiden")
+    parser.add_argument("--parallel", type=_getallen, default=[1, 4], help="parallelle requests, komma-gescheiden")
+    parser.add_argument("--ontdubbel", type=_getallen, default=[0, 1], help="ontdubbeling uit/aan (0,1)")
+    parser.add_argument("--wegnummer", type=_getallen, default=[1],
+                        help="wegnummer meesturen + groeperen uit/aan (0,1)")
+    parser.add_argument("--latentie-zonder-wegnummer-ms", type=float, default=0.0,
+                        help="extra latentie per locatie zonder wegnummer")
+    parser.add_argument("--latentie-ms", type=float, default=50.0)
+    parser.add_argument("--latentie-per-locatie-ms", type=float, default=0.5)
+    parser.add_argument("--foutkans", type=float, default=0.0)
+    parser.add_argument("--vorm", choices=("volledig", "fouten", "kort"), default="volledig")
+    parser.add_argument("--uitvoer", help="schrijf alle resultaten als JSON naar dit bestand")
+    parser.add_argument("--in-proces", action="store_true", help="alle scenario's in dit proces draaien")
+    parser.add_argument("--eindpunten", type=int, metavar="VERTICES",
+                        help="enkel de micro-benchmark van de eindpuntextractie draaien (bv. 10000)")
+    parser.add_argument("--bulk", type=int, metavar="FEATURES",
+                        help="enkel de controle van de snelle bulk-update draaien voor zoveel features")
+    parser.add_argument("--postgres", metavar="CONNINFO", help="bij --bulk ook PostGIS controleren (libpq conninfo)")
+    parser.add_argument("--geheugen", type=int, metavar="EINDPUNTEN",
+                        help="enkel de geheugenbenchmark van de chunk-werkset draaien (bv. 100000)")
+    # intern: één scenario draaien in een kindproces
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--meet-geheugen", choices=("dicts", "compact"), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.meet_geheugen:
+        print(json.dumps(meet_geheugen(args.meet_geheugen, args.aantal)))
+        return 0
+    if args.geheugen:
+        resultaten = geheugen_benchmark(args.geheugen)
+        if args.uitvoer:
+            with open(args.uitvoer, "w", encoding="utf-8") as f:
+                json.dump(resultaten, f, indent=2)
+        return 0
+
+    app = start_qgis()
+    if args.bulk:
+        resultaten = bulk_check(args.bulk, args.postgres)
+        if args.uitvoer:
+            with open(args.uitvoer, "w", encoding="utf-8") as f:
+                json.dump(resultaten, f, indent=2)
+        if app is not None:
+            app.exitQgis()
+        return 0
+    if args.eindpunten:
+        resultaten = eindpunten_benchmark(args.eindpunten)
+        if args.uitvoer:
+            with open(args.uitvoer, "w", encoding="utf-8") as f:
+                json.dump(resultaten, f, indent=2)
+        if app is not None:
+            app.exitQgis()
+        return 0
+
+    if args.scenario:
+        print(json.dumps(draai_scenario(json.loads(args.scenario), args.url, args.cache_dir)))
+        return 0
+
+    server = Ls2StandIn(args.latentie_ms, args.latentie_per_locatie_ms, args.foutkans, args.vorm,
+                        args.latentie_zonder_wegnummer_ms).start()
+    resultaten = []
+    with tempfile.TemporaryDirectory(prefix="ls2_benchmark_") as cache_dir:
+        try:
+            for scenario in scenarios(args):
+                server.reset()
+                if args.in_proces:
+                    resultaat = draai_scenario(scenario, server.url, cache_dir)
+                else:
+                    uitvoer = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--scenario", json.dumps(scenario),
+                         "--url", server.url, "--cache-dir", cache_dir],
+                        check=True, capture_output=True, text=True
+                    ).stdout
+                    resultaat = json.loads(uitvoer.strip().splitlines()[-1])
+                resultaat["requests"] = server.aantal_requests
+                resultaat["requests_per_s"] = round(server.aantal_requests / resultaat["seconden"], 1)
+                resultaten.append(resultaat)
+                print(
+                    f"{resultaat['type']:<16} chunk={resultaat['chunk']:<5} parallel={resultaat['parallel']:<3}"
+                    f" ontdubbel={int(resultaat['ontdubbel'])} wegnummer={int(resultaat['wegnummer'])}"
+                    f" {resultaat['features_per_s']:>9} f/s"
+                    f"  {resultaat['requests_per_s']:>7} req/s  {resultaat['locaties_per_s']:>9} loc/s"
+                    f"  piek RSS {resultaat['piek_rss_mb'] or 0:.0f} MB",
+                    flush=True
+                )
+        finally:
+            server.stop()
+
+    if args.uitvoer:
+        with open(args.uitvoer, "w", encoding="utf-8") as f:
+            json.dump(resultaten, f, indent=2)
+    if app is not None:
+        app.exitQgis()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
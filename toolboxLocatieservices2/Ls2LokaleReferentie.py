@@ -0,0 +1,266 @@
+"""
+Lokale referentie-engine voor Ls2AttributenEindpunten.
+
+Bepaalt voor een punt (wegnummer, referentiepunt wegnummer, opschrift, afstand) zonder LS2:
+dichtstbijzijnde wegas binnen de zoekafstand, het laatste referentiepunt ervoor langs die as
+en de afstand langs de as tot dat referentiepunt. Punten die niet eenduidig lokaal op te lossen
+zijn (geen as binnen de zoekafstand, twee wegen even dichtbij, geen referentiepunt ervoor)
+geven None terug en worden dan gewoon aan LS2 gevraagd.
+
+De referentiepunten en wegassen worden één keer geïmporteerd in een lokale GeoPackage
+(importeer_referentiedata), met de wegassen per wegnummer samengevoegd tot doorlopende delen.
+Zoekafstand, marges en de afstand langs de as worden in kaarteenheden gerekend: de wegassen
+moeten daarom in een geprojecteerd CRS (meter, bv. EPSG:31370) liggen, niet in graden.
+"""
+
+import os
+from bisect import bisect_right
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsField,
+    QgsGeometry,
+    QgsPointXY,
+    QgsProject,
+    QgsSpatialIndex,
+    QgsVectorFileWriter,
+    QgsVectorLayer
+)
+from qgis.PyQt.QtCore import QVariant
+
+# QGIS 4 / Qt6 gebruikt QMetaType i.p.v. QVariant (zelfde keuze als Ls2AttributenEindpunten)
+try:
+    from qgis.PyQt.QtCore import QMetaType
+    TYPE_STRING = QMetaType.Type.QString
+except Exception:
+    TYPE_STRING = QVariant.String
+
+LAAG_WEGASSEN = "wegassen"
+LAAG_REFERENTIEPUNTEN = "referentiepunten"
+MAX_AFSTAND_REFERENTIEPUNT = 20.0  # m, referentiepunt moet zo dicht bij de as van zijn weg liggen
+DUBBELZINNIG_MARGE = 1.0  # m, twee verschillende wegen binnen deze marge: LS2 laten beslissen
+
+
+def _controleer_crs(crs, bron):
+    if crs.isGeographic():
+        raise Exception(
+            f"{bron} ligt in een geografisch CRS ({crs.authid()}): de lokale referentie rekent afstanden "
+            f"in meter, gebruik een geprojecteerd CRS (bv. EPSG:31370).")
+
+
+def _schrijf_tabel(layer, gpkg_pad, tabel, feedback=None):
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "GPKG"
+    options.layerName = tabel
+    if os.path.exists(gpkg_pad):
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+    fout, melding = QgsVectorFileWriter.writeAsVectorFormatV3(
+        layer, gpkg_pad, QgsCoordinateTransformContext(), options)[:2]
+    if fout != QgsVectorFileWriter.NoError:
+        raise Exception(f"Schrijven van {tabel} naar {gpkg_pad} mislukt: {melding}")
+    if feedback:
+        feedback.pushInfo(f"{layer.featureCount()} features geschreven naar {gpkg_pad}|{tabel}")
+
+
+def importeer_referentiedata(referentiepunten, wegen, gpkg_pad, veld_wegnummer_ref="wegnummer",
+                             veld_opschrift="opschrift", veld_wegnummer_weg="wegnummer", feedback=None):
+    """
+    Importeer referentiepunten en wegassen (elke QGIS-bron, bv. een WFS- of bestandslaag)
+    in een lokale GeoPackage, in het CRS van de wegen.
+    Wegassen worden per wegnummer samengevoegd (mergeLines) en als enkelvoudige delen bewaard.
+    """
+    crs = wegen.crs()
+    _controleer_crs(crs, "De wegenlaag")
+    naar_wegen = QgsCoordinateTransform(referentiepunten.crs(), crs, QgsProject.instance())
+
+    # wegassen per wegnummer samenvoegen
+    per_wegnummer = {}
+    idx_weg = wegen.fields().indexFromName(veld_wegnummer_weg)
+    if idx_weg == -1:
+        raise Exception(f"Veld {veld_wegnummer_weg} niet gevonden in de wegenlaag.")
+    req = QgsFeatureRequest().setSubsetOfAttributes([idx_weg])
+    for feature in wegen.getFeatures(req):
+        waarde = feature[idx_weg]
+        if waarde in (None, "") or not feature.hasGeometry():
+            continue
+        per_wegnummer.setdefault(str(waarde), []).append(feature.geometry())
+
+    assen = QgsVectorLayer(f"LineString?crs={crs.authid()}", LAAG_WEGASSEN, "memory")
+    assen.dataProvider().addAttributes([QgsField("wegnummer", TYPE_STRING)])
+    assen.updateFields()
+    features = []
+    for wegnummer, geometrieen in per_wegnummer.items():
+        samengevoegd = QgsGeometry.collectGeometry(geometrieen).mergeLines()
+        for deel in samengevoegd.constParts():
+            feature = QgsFeature(assen.fields())
+            feature.setGeometry(QgsGeometry(deel.clone()))
+            feature.setAttributes([wegnummer])
+            features.append(feature)
+    assen.dataProvider().addFeatures(features)
+
+    # referentiepunten (wegnummer + opschrift) naar het CRS van de wegen
+    idx_ref = referentiepunten.fields().indexFromName(veld_wegnummer_ref)
+    idx_opschrift = referentiepunten.fields().indexFromName(veld_opschrift)
+    if idx_ref == -1 or idx_opschrift == -1:
+        raise Exception(f"Velden {veld_wegnummer_ref}/{veld_opschrift} niet gevonden in de referentiepuntenlaag.")
+    punten = QgsVectorLayer(f"Point?crs={crs.authid()}", LAAG_REFERENTIEPUNTEN, "memory")
+    punten.dataProvider().addAttributes([QgsField("wegnummer", TYPE_STRING), QgsField("opschrift", TYPE_STRING)])
+    punten.updateFields()
+    features = []
+    req = QgsFeatureRequest().setSubsetOfAttributes([idx_ref, idx_opschrift])
+    for feature in referentiepunten.getFeatures(req):
+        if not feature.hasGeometry() or feature[idx_ref] in (None, ""):
+            continue
+        geom = QgsGeometry(feature.geometry())
+        geom.transform(naar_wegen)
+        nieuw = QgsFeature(punten.fields())
+        nieuw.setGeometry(geom)
+        nieuw.setAttributes([str(feature[idx_ref]), str(feature[idx_opschrift])])
+        features.append(nieuw)
+    punten.dataProvider().addFeatures(features)
+
+    _schrijf_tabel(assen, gpkg_pad, LAAG_WEGASSEN, feedback)
+    _schrijf_tabel(punten, gpkg_pad, LAAG_REFERENTIEPUNTEN, feedback)
+    return gpkg_pad
+
+
+class _Asdeel:
+    """Een doorlopend deel van een wegas met zijn referentiepunten, gesorteerd langs de as."""
+
+    __slots__ = ("wegnummer", "geom", "lengte", "omgekeerd", "maten", "refpunten")
+
+    def __init__(self, wegnummer, geom):
+        self.wegnummer = wegnummer
+        self.geom = geom
+        self.lengte = geom.length()
+        self.omgekeerd = False
+        self.maten = []
+        self.refpunten = []  # (referentiepunt wegnummer, opschrift), zelfde volgorde als maten
+
+    def maat(self, punt_geom):
+        """Afstand langs het deel, in de richting van stijgende opschriften."""
+        maat = self.geom.lineLocatePoint(punt_geom)
+        return self.lengte - maat if self.omgekeerd else maat
+
+    def sorteer(self, gevonden):
+        """gevonden: [(maat langs digitalisatierichting, wegnummer, opschrift)]."""
+        gevonden.sort()
+        if len(gevonden) > 1:
+            try:
+                # opschriften dalen langs de digitalisatierichting: richting omdraaien
+                self.omgekeerd = float(gevonden[0][2]) > float(gevonden[-1][2])
+            except ValueError:
+                pass
+        if self.omgekeerd:
+            gevonden = sorted((self.lengte - maat, wegnr, opschrift) for maat, wegnr, opschrift in gevonden)
+        self.maten = [maat for maat, _, _ in gevonden]
+        self.refpunten = [(wegnr, opschrift) for _, wegnr, opschrift in gevonden]
+
+
+class LokaleReferentie:
+    """
+    Lokale referentie-engine op basis van een GeoPackage uit importeer_referentiedata.
+    bepaal() geeft dezelfde tuple als _extract_refpunt_values, of None (=> LS2 vragen).
+    """
+
+    def __init__(self, gpkg_pad, zoekafstand=20.0, crs_id=None, feedback=None, afstand_decimalen=None):
+        self.zoekafstand = float(zoekafstand)
+        self.afstand_decimalen = afstand_decimalen  # None = afstand niet afronden
+        self.opgelost = 0
+        self.niet_opgelost = 0
+
+        assen = QgsVectorLayer(f"{gpkg_pad}|layername={LAAG_WEGASSEN}", LAAG_WEGASSEN, "ogr")
+        punten = QgsVectorLayer(f"{gpkg_pad}|layername={LAAG_REFERENTIEPUNTEN}", LAAG_REFERENTIEPUNTEN, "ogr")
+        if not assen.isValid() or not punten.isValid():
+            raise Exception(f"{gpkg_pad} bevat geen tabellen {LAAG_WEGASSEN}/{LAAG_REFERENTIEPUNTEN}.")
+        _controleer_crs(assen.crs(), gpkg_pad)
+
+        # punten uit de invoerlaag naar het CRS van de referentiedata
+        self.transformatie = None
+        if crs_id and crs_id != assen.crs().authid():
+            self.transformatie = QgsCoordinateTransform(
+                QgsCoordinateReferenceSystem(crs_id), assen.crs(), QgsProject.instance())
+
+        # ruimtelijke index met echte geometrieën: nearestNeighbor rekent dan op de as, niet op de bbox
+        self.index = QgsSpatialIndex(QgsSpatialIndex.FlagStoreFeatureGeometries)
+        self.delen = {}
+        idx_wegnummer = assen.fields().indexFromName("wegnummer")
+        for feature in assen.getFeatures():
+            self.delen[feature.id()] = _Asdeel(feature[idx_wegnummer], QgsGeometry(feature.geometry()))
+            self.index.addFeature(feature)
+
+        # elk referentiepunt koppelen aan het dichtstbijzijnde asdeel met hetzelfde wegnummer
+        gevonden = {}
+        idx_wegnummer = punten.fields().indexFromName("wegnummer")
+        idx_opschrift = punten.fields().indexFromName("opschrift")
+        for feature in punten.getFeatures():
+            geom = feature.geometry()
+            wegnummer = feature[idx_wegnummer]
+            kandidaten = [
+                fid for fid in self.index.nearestNeighbor(geom.asPoint(), 5, MAX_AFSTAND_REFERENTIEPUNT)
+                if self.delen[fid].wegnummer == wegnummer
+            ]
+            if not kandidaten:
+                continue
+            fid = min(kandidaten, key=lambda f: self.delen[f].geom.distance(geom))
+            maat = self.delen[fid].geom.lineLocatePoint(geom)
+            gevonden.setdefault(fid, []).append((maat, wegnummer, feature[idx_opschrift]))
+        for fid, deel_gevonden in gevonden.items():
+            self.delen[fid].sorteer(deel_gevonden)
+
+        if feedback:
+            feedback.pushInfo(
+                f"lokale referentie: {len(self.delen)} asdelen, "
+                f"{sum(len(v) for v in gevonden.values())} referentiepunten gekoppeld")
+
+    def bepaal(self, x, y, wegnummer=None):
+        """(wegnummer, referentiepunt wegnummer, opschrift, afstand) of None als het niet eenduidig is."""
+        punt = QgsPointXY(x, y)
+        if self.transformatie is not None:
+            punt = self.transformatie.transform(punt)
+        punt_geom = QgsGeometry.fromPointXY(punt)
+
+        kandidaten = self.index.nearestNeighbor(punt, 3, self.zoekafstand)
+        if wegnummer not in (None, ""):
+            kandidaten = [fid for fid in kandidaten if self.delen[fid].wegnummer == wegnummer]
+        afstanden = sorted((self.delen[fid].geom.distance(punt_geom), fid) for fid in kandidaten)
+        if not afstanden:
+            return self._niet_opgelost()
+        afstand, fid = afstanden[0]
+        deel = self.delen[fid]
+        for andere_afstand, andere_fid in afstanden[1:]:
+            if andere_afstand - afstand < DUBBELZINNIG_MARGE and self.delen[andere_fid].wegnummer != deel.wegnummer:
+                return self._niet_opgelost()
+
+        maat = deel.maat(punt_geom)
+        positie = bisect_right(deel.maten, maat) - 1
+        if positie < 0:
+            # geen referentiepunt vóór dit punt op hetzelfde asdeel
+            return self._niet_opgelost()
+        referentiepunt_wegnr, opschrift = deel.refpunten[positie]
+        self.opgelost += 1
+        afstand = maat - deel.maten[positie]
+        if self.afstand_decimalen is not None:
+            afstand = round(afstand, self.afstand_decimalen)
+        return deel.wegnummer, referentiepunt_wegnr, opschrift, afstand
+
+    def _niet_opgelost(self):
+        self.niet_opgelost += 1
+        return None
+
+
+def als_response(waarden):
+    """Zet een bepaal()-tuple om naar de vorm van een LS2-response, zodat de writer ze gelijk behandelt."""
+    wegnummer, referentiepunt_wegnr, opschrift, afstand = waarden
+    return {
+        "success": {"relatief": {
+            "wegnummer": {"nummer": wegnummer},
+            "referentiepunt": {"wegnummer": {"nummer": referentiepunt_wegnr}, "opschrift": opschrift},
+            "afstand": afstand,
+        }},
+        "bron": "lokaal",
+    }